@@ -0,0 +1,494 @@
+"""
+ftpserver.py
+------------
+Local stand-in for a Unix gate and the hosts behind it, for the benchmarks.
+
+It speaks just enough FTP for fts.py: the gateway login (USER/PASS), then the
+proxy login to a remote host (USER user@host, PASS), after which every command
+works in <root>/<host>: PASV data connections, RETR/STOR/APPE with REST, SIZE,
+MDTM, MLSD, NLST, MKD, HASH, etc. Any password is accepted. The only SITE EXEC
+it runs is "tar -xf <file>" (done with tarfile), to unpack the --bundle uploads.
+
+DelayProxy sits in front of it to emulate a high-latency gateway link: whatever
+goes through, in either direction, is held back by the same one-way delay. The
+PASV replies are rewritten to a proxy of their own, so the data connections get
+the delay as well.
+
+Usage:
+$ python benchmarks/ftpserver.py --root /tmp/ftproot --port 2121
+$ python benchmarks/ftpserver.py --root /tmp/ftproot --latency 40
+"""
+
+import argparse
+import hashlib
+import queue
+import re
+import socket
+import socketserver
+import tarfile
+import threading
+import time
+from pathlib import Path
+
+
+# seconds to wait for the client to open a data connection after PASV
+DATA_TIMEOUT = 10
+
+# bytes read from a socket or a file at a time
+CHUNK = 256 * 1024
+
+
+class FtpHandler(socketserver.StreamRequestHandler):
+    """Handles one control connection: the gateway login, the remote host login, then the FTP commands"""
+
+    def setup(self):
+        super().setup()
+        # replies come in pairs (e.g. 150 then 226), don't let Nagle hold the second one back for a delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.gate_user = None
+        self.remote_host = None
+        self.base = None
+        self.cwd = None
+        self.pasv = None
+        self.rest = 0
+
+
+    def handle(self):
+        self.reply('220 Local gate stand-in ready')
+
+        for line in self.rfile:
+            command, _, arg = line.decode('latin-1').rstrip('\r\n').partition(' ')
+            command = command.upper()
+
+            handler = getattr(self, f'do_{command}', None)
+            if not handler:
+                self.reply(f'502 {command} not implemented')
+            elif self.base is None and command not in ('USER', 'PASS', 'QUIT', 'NOOP', 'FEAT', 'REIN'):
+                self.reply('530 Please login with USER and PASS')
+            else:
+                try:
+                    if handler(arg) == 'quit':
+                        break
+                except (OSError, ValueError) as e:
+                    self.reply(f'550 {arg}: {e}')
+
+        if self.pasv:
+            self.pasv.close()
+
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode('latin-1'))
+        self.wfile.flush()
+
+
+    def path(self, arg):
+        """Class method that returns the Path of a remote file or directory, which can't be outside of the host's root"""
+
+        path = (self.base / arg.lstrip('/') if arg.startswith('/') else self.cwd / arg).resolve()
+        if path != self.base and self.base not in path.parents:
+            raise PermissionError(arg)
+        return path
+
+
+    def data_connection(self):
+        """Class method that accepts the data connection of the last PASV"""
+
+        listener, self.pasv = self.pasv, None
+        if not listener:
+            raise OSError('use PASV first')
+        with listener:
+            listener.settimeout(DATA_TIMEOUT)
+            conn, _ = listener.accept()
+        return conn
+
+
+    # =========================================================================
+    # login: the Unix gate first, then USER user@host switches to the remote host
+
+    def do_USER(self, arg):
+        if '@' in arg:
+            if not self.gate_user:
+                self.reply('530 Login to the gate first')
+                return
+            self.remote_host = arg.split('@', 1)[1]
+            self.reply(f'331 Password required for {arg}')
+        else:
+            self.gate_user = None
+            self.remote_host = arg
+            self.reply('331 Password required')
+
+
+    def do_PASS(self, arg):
+        if self.remote_host and not self.gate_user:
+            self.gate_user = self.remote_host
+            self.remote_host = None
+            self.reply(f'230 User {self.gate_user} logged in to the gate')
+        elif self.remote_host:
+            self.base = (self.server.root / self.remote_host).resolve()
+            self.base.mkdir(parents=True, exist_ok=True)
+            self.cwd = self.base
+            self.reply(f'230 Logged in to {self.remote_host}')
+        else:
+            self.reply('503 Login with USER first')
+
+
+    def do_REIN(self, arg):
+        self.remote_host = None
+        self.base = None
+        self.cwd = None
+        self.reply('220 Ready for a new remote host')
+
+
+    def do_QUIT(self, arg):
+        self.reply('221 Goodbye')
+        return 'quit'
+
+
+    # =========================================================================
+    # session settings
+
+    def do_NOOP(self, arg):
+        self.reply('200 NOOP ok')
+
+
+    def do_TYPE(self, arg):
+        self.reply(f'200 Type set to {arg}')
+
+
+    def do_FEAT(self, arg):
+        self.reply('211-Features:\r\n MLST size*;modify*;type*;\r\n HASH SHA-256*\r\n REST STREAM\r\n SIZE\r\n MDTM\r\n211 End')
+
+
+    def do_OPTS(self, arg):
+        self.reply('200 OPTS ok')
+
+
+    # =========================================================================
+    # directories
+
+    def do_PWD(self, arg):
+        directory = self.cwd.relative_to(self.base).as_posix()
+        self.reply(f'257 "/{"" if directory == "." else directory}"')
+
+
+    def do_CWD(self, arg):
+        path = self.path(arg)
+        if path.is_dir():
+            self.cwd = path
+            self.reply('250 Directory changed')
+        else:
+            self.reply(f'550 {arg}: no such directory')
+
+
+    def do_MKD(self, arg):
+        try:
+            self.path(arg).mkdir()
+            self.reply(f'257 "{arg}" created')
+        except OSError as e:
+            self.reply(f'550 {arg}: {e.strerror or e}')
+
+
+    def do_MLSD(self, arg):
+        path = self.path(arg) if arg else self.cwd
+        if not path.is_dir():
+            self.reply(f'550 {arg}: no such directory')
+            return
+
+        lines = []
+        for entry in sorted(path.iterdir()):
+            entry_stat = entry.stat()
+            modify = time.strftime('%Y%m%d%H%M%S', time.gmtime(entry_stat.st_mtime))
+            lines.append(f'type={"dir" if entry.is_dir() else "file"};size={entry_stat.st_size};modify={modify}; {entry.name}\r\n')
+        self.send_listing(''.join(lines))
+
+
+    def do_NLST(self, arg):
+        path = self.path(arg) if arg else self.cwd
+        if not path.is_dir():
+            self.reply(f'550 {arg}: no such directory')
+            return
+        self.send_listing(''.join(f'{entry.name}\r\n' for entry in sorted(path.iterdir())))
+
+
+    def send_listing(self, listing):
+        self.reply('150 Here comes the listing')
+        with self.data_connection() as conn:
+            conn.sendall(listing.encode('latin-1'))
+        self.reply('226 Listing sent')
+
+
+    # =========================================================================
+    # files
+
+    def do_SIZE(self, arg):
+        path = self.path(arg)
+        if path.is_file():
+            self.reply(f'213 {path.stat().st_size}')
+        else:
+            self.reply(f'550 {arg}: no such file')
+
+
+    def do_MDTM(self, arg):
+        path = self.path(arg)
+        if path.is_file():
+            self.reply(f'213 {time.strftime("%Y%m%d%H%M%S", time.gmtime(path.stat().st_mtime))}')
+        else:
+            self.reply(f'550 {arg}: no such file')
+
+
+    def do_HASH(self, arg):
+        path = self.path(arg)
+        if not path.is_file():
+            self.reply(f'550 {arg}: no such file')
+            return
+
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(CHUNK), b''):
+                hasher.update(block)
+        self.reply(f'213 SHA-256 0-{path.stat().st_size} {hasher.hexdigest()} {arg}')
+
+
+    def do_DELE(self, arg):
+        path = self.path(arg)
+        if path.is_file():
+            path.unlink()
+            self.reply('250 File deleted')
+        else:
+            self.reply(f'550 {arg}: no such file')
+
+
+    def do_SITE(self, arg):
+        words = arg.split()
+        if words[:3] != ['EXEC', 'tar', '-xf'] or len(words) != 4:
+            self.reply(f'502 SITE {arg} not implemented')
+            return
+
+        try:
+            with tarfile.open(self.path(words[3])) as tar:
+                for member in tar.getmembers():
+                    # raises PermissionError for anything that would be unpacked outside of the host's root
+                    self.path(member.name)
+                tar.extractall(self.cwd)
+        except tarfile.TarError as e:
+            self.reply(f'550 {words[3]}: {e}')
+            return
+        self.reply(f'200 {words[3]} unpacked')
+
+
+    def do_REST(self, arg):
+        self.rest = int(arg)
+        self.reply(f'350 Restarting at {self.rest}')
+
+
+    def do_PASV(self, arg):
+        if self.pasv:
+            self.pasv.close()
+        self.pasv = socket.socket()
+        self.pasv.bind((self.connection.getsockname()[0], 0))
+        self.pasv.listen(1)
+
+        host, port = self.pasv.getsockname()
+        self.reply(f'227 Entering Passive Mode ({host.replace(".", ",")},{port >> 8},{port & 255})')
+
+
+    def do_ABOR(self, arg):
+        self.reply('226 Abort ok')
+
+
+    def do_RETR(self, arg):
+        path = self.path(arg)
+        rest, self.rest = self.rest, 0
+        if not path.is_file():
+            self.reply(f'550 {arg}: no such file')
+            return
+
+        self.reply(f'150 Opening BINARY mode data connection for {arg}')
+        try:
+            with self.data_connection() as conn, open(path, 'rb') as f:
+                conn.sendfile(f, offset=rest)
+        except OSError:
+            self.reply('426 Connection closed, transfer aborted')
+            return
+        self.reply('226 Transfer complete')
+
+
+    def do_STOR(self, arg):
+        self.store(arg, 'r+b' if self.rest else 'wb')
+
+
+    def do_APPE(self, arg):
+        self.store(arg, 'ab')
+
+
+    def store(self, arg, mode):
+        path = self.path(arg)
+        rest, self.rest = self.rest, 0
+        if mode == 'r+b' and not path.exists():
+            path.touch()
+
+        self.reply(f'150 Ok to send data for {arg}')
+        with self.data_connection() as conn, open(path, mode) as f:
+            if rest:
+                f.seek(rest)
+                f.truncate()
+            for block in iter(lambda: conn.recv(CHUNK), b''):
+                f.write(block)
+        self.reply('226 Transfer complete')
+
+
+class FtpServer(socketserver.ThreadingTCPServer):
+    """
+    The stand-in server, one thread per control connection
+
+    Attributes:
+    root (Path): Directory holding one subdirectory per remote host
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, root, port=0, host='127.0.0.1'):
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        super().__init__((host, port), FtpHandler)
+
+
+    def start(self):
+        """Class method to serve in a background thread; returns the port listened on"""
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address[1]
+
+
+class DelayProxy():
+    """
+    TCP proxy that forwards everything to target after a one-way delay, in both directions.
+    Blocks keep their order and are not slowed down otherwise, so it's latency, not a bandwidth limit.
+
+    Attributes:
+    target (tuple): Host and port to forward to
+    delay (float): One-way delay in seconds
+    once (bool): Accept a single connection (the data connection of a PASV), then stop listening
+    port (int): Port to listen on (default: any free one)
+    """
+
+    def __init__(self, target, delay, once=False, host='127.0.0.1', port=0):
+        self.target = target
+        self.delay = delay
+        self.once = once
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+
+
+    def start(self):
+        """Class method to accept connections in a background thread; returns the port listened on"""
+
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self.port
+
+
+    def _accept(self):
+        if self.once:
+            self.listener.settimeout(DATA_TIMEOUT)
+
+        with self.listener:
+            while True:
+                try:
+                    client, _ = self.listener.accept()
+                except OSError:
+                    return
+
+                upstream = socket.create_connection(self.target)
+                for conn in (client, upstream):
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+                # only the control connection's replies (not the data) have PASV ports to rewrite
+                self._pipe(client, upstream)
+                self._pipe(upstream, client, None if self.once else self._rewrite_pasv)
+
+                if self.once:
+                    return
+
+
+    def _pipe(self, source, dest, rewrite=None):
+        """Class method to forward source to dest: one thread reads and timestamps, another sends when due"""
+
+        blocks = queue.Queue()
+
+        def read():
+            pending = b''
+            while True:
+                try:
+                    block = source.recv(CHUNK)
+                except OSError:
+                    block = b''
+
+                if rewrite and block:
+                    # replies are rewritten line by line, so hold on to an incomplete one
+                    pending += block
+                    lines = pending.split(b'\n')
+                    pending = lines.pop()
+                    block = b''.join(rewrite(line + b'\n') for line in lines)
+                    if not block:
+                        continue
+
+                blocks.put((time.monotonic() + self.delay, block))
+                if not block:
+                    return
+
+        def send():
+            while True:
+                due, block = blocks.get()
+                time.sleep(max(0.0, due - time.monotonic()))
+                try:
+                    if not block:
+                        dest.shutdown(socket.SHUT_WR)
+                        return
+                    dest.sendall(block)
+                except OSError:
+                    return
+
+        threading.Thread(target=read, daemon=True).start()
+        threading.Thread(target=send, daemon=True).start()
+
+
+    def _rewrite_pasv(self, line):
+        match = re.match(rb'227 .*\((\d+),(\d+),(\d+),(\d+),(\d+),(\d+)\)', line)
+        if not match:
+            return line
+
+        numbers = [int(number) for number in match.groups()]
+        port = DelayProxy((self.target[0], numbers[4] << 8 | numbers[5]), self.delay, once=True).start()
+        return f'227 Entering Passive Mode (127,0,0,1,{port >> 8},{port & 255})\r\n'.encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='local stand-in for a Unix gate, for the benchmarks')
+    parser.add_argument('--root', type=Path, required=True, help='directory holding one subdirectory per remote host')
+    parser.add_argument('--port', type=int, default=0, help='port to listen on (default: any free one)')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='round-trip time (milliseconds) to emulate through a delay proxy (default 0: none)')
+    args = parser.parse_args()
+
+    if args.latency:
+        # the server itself listens on any port, the proxy in front of it on --port
+        server = FtpServer(args.root)
+        port = DelayProxy(('127.0.0.1', server.start()), args.latency / 2000, port=args.port).start()
+    else:
+        server = FtpServer(args.root, args.port)
+        port = server.start()
+
+    # the benchmarks read the port from this first line
+    print(f'listening on 127.0.0.1:{port}', flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
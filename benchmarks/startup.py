@@ -0,0 +1,141 @@
+"""
+startup.py
+----------
+Benchmark of the start up of fts.py, i.e. what a cron-driven run pays before the
+first connection to the Unix gate: the interpreter and the imports, then loading
+the configuration from the CSV files.
+
+python fts.py compiles the whole script on every run, python -m fts reuses the
+compiled fts.py from __pycache__ (written by its first run), so both are measured.
+
+The CSV files are generated in a temporary directory with as many MS client
+instances as needed (--rows), then resolved the 3 ways fts.py can:
+parsing every CSV file, loading them from the cache, and (when -g, -s ms and -i
+are all passed) looking up only the rows needed.
+
+Usage:
+$ python benchmarks/startup.py --rows 20000 --runs 20
+$ python benchmarks/startup.py --script /path/to/another/fts.py
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+DEFAULT_SCRIPT = Path(__file__).resolve().parent.parent / 'fts.py'
+CSV_FILES = {'gateway_hosts': 'gateway_hosts.csv', 'ms_client_accounts': 'ms_client_accounts.csv',
+             'non_ms_servers': 'non_ms_servers.csv', 'server_group': 'server_group.csv'}
+
+
+def write_config(directory, rows):
+    """
+    Function to write the JSON file and the CSV files fts.py reads, with rows MS client instances
+
+    Arguments:
+    directory (Path): Where to write them (fts.json, and the CSV files under config/)
+    rows (int): Number of MS client instances
+
+    Returns:
+    The last MS client instance (the worst case for the look up)
+    """
+
+    config_dir = directory / 'config'
+    config_dir.mkdir()
+    json_config = {'fts_config': {'gateway': {'username': 'user', 'password': 'password'}, 'nonms': {},
+                                  'csv': {'csv_dir': 'config',
+                                          'csv_files': [{key: value} for key, value in CSV_FILES.items()]},
+                                  'log': {'log_suffix': '_fts.log', 'log_dir': 'logs'}}}
+    (directory / 'fts.json').write_text(json.dumps(json_config))
+
+    (config_dir / CSV_FILES['gateway_hosts']).write_text(
+        'location,fq-hostname\n' + ''.join(f'gate{n},gate{n}.internal.net\n' for n in range(1, 21)))
+    (config_dir / CSV_FILES['server_group']).write_text('server-group,group-name\nManaged Services,ms\nNon MS,nonms\n')
+    (config_dir / CSV_FILES['non_ms_servers']).write_text(
+        'host,fq-hostname\n' + ''.join(f'host{n},host{n}.internal.net\n' for n in range(1, 101)))
+    (config_dir / CSV_FILES['ms_client_accounts']).write_text(
+        'instance,hostname,password,clientid\n' + ''.join(
+            f'instance{n},host{n:05}.internal.net,pw{n},C{n % 500:04}\n' for n in range(1, rows + 1)))
+
+    return f'instance{rows}'
+
+
+def timed(function, runs):
+    """
+    Function to call function runs times
+
+    Returns:
+    A tuple of the best and the median durations, in milliseconds
+    """
+
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return min(durations), statistics.median(durations)
+
+
+def report(label, durations):
+    best, median = durations
+    print(f'{label:<40} best {best:8.2f} ms   median {median:8.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark of the start up of fts.py')
+    parser.add_argument('--script', type=Path, default=DEFAULT_SCRIPT, help='fts.py to benchmark')
+    parser.add_argument('--rows', type=int, default=20000, help='MS client instances in the CSV file (default 20000)')
+    parser.add_argument('--runs', type=int, default=20, help='runs of each measure (default 20)')
+    args = parser.parse_args()
+
+    script = args.script.resolve()
+    print(f'{script} ({args.rows} MS client instances, {args.runs} runs)')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        instance = write_config(Path(temp_dir), args.rows)
+
+        # interpreter start up and the imports, no configuration read
+        report('python fts.py --help', timed(lambda: subprocess.run(
+            [sys.executable, str(script), '--help'], stdout=subprocess.DEVNULL, check=True), args.runs))
+
+        # -m only finds fts (i.e. --script named something else isn't measured this way)
+        if script.stem == 'fts':
+            env = dict(os.environ, PYTHONPATH=str(script.parent))
+            env.pop('PYTHONDONTWRITEBYTECODE', None)
+            module_help = lambda: subprocess.run([sys.executable, '-m', 'fts', '--help'],
+                                                 stdout=subprocess.DEVNULL, env=env, check=True)
+            # writes __pycache__ if it isn't there yet
+            module_help()
+            report('python -m fts --help', timed(module_help, args.runs))
+
+        spec = importlib.util.spec_from_file_location('fts', script)
+        fts = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(fts)
+
+        logger = logging.getLogger('startup')
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+        csv_files = [(CSV_FILES['gateway_hosts'], False), (CSV_FILES['server_group'], False),
+                     (CSV_FILES['non_ms_servers'], False), (CSV_FILES['ms_client_accounts'], True)]
+
+        report('parse every CSV file', timed(lambda: [fts.parse_csv(filename, logger, sort=sort)
+                                                       for filename, sort in csv_files], args.runs))
+        if hasattr(fts, 'load_csv_files'):
+            fts.load_csv_files(logger, csv_files)
+            report('load them from the cache', timed(lambda: fts.load_csv_files(logger, csv_files), args.runs))
+        if hasattr(fts, 'lookup_csv_rows'):
+            report(f'look up -g gate20 -s ms -i {instance}', timed(lambda: fts.lookup_csv_rows(
+                logger, [filename for filename, sort in csv_files], 'gate20', instance), args.runs))
+
+
+if __name__ == '__main__':
+    main()
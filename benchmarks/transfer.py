@@ -0,0 +1,263 @@
+"""
+transfer.py
+-----------
+Benchmark of the FtpConnection transfers against a local stand-in of the Unix gate
+(see ftpserver.py), with the same gateway-then-remote host login as the real one.
+
+Scenarios (each one uploads its files, then downloads them back):
+  small     many small files, where the round trips per file dominate
+  huge      a few huge files, where the data path (block size, buffers) dominates
+  latency   the small files again, through a delay proxy emulating a distant gateway
+
+Every scenario runs in a fresh process, so its CPU time (user + system) and peak
+RSS are its own. The results (MB/s, CPU time, peak RSS, with the settings used)
+are saved as JSON, which --compare puts side by side with another run's.
+
+Usage:
+$ python benchmarks/transfer.py
+$ python benchmarks/transfer.py --engine async --parallel 8 --output async8.json
+$ python benchmarks/transfer.py --blocksize 262144 --scenarios huge
+$ python benchmarks/transfer.py --bundle --scenarios small latency
+$ python benchmarks/transfer.py --compare before.json after.json
+"""
+
+import argparse
+import datetime
+import importlib.util
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+DEFAULT_SCRIPT = BENCHMARKS_DIR.parent / 'fts.py'
+RESULTS_DIR = BENCHMARKS_DIR / 'results'
+SCENARIOS = ['small', 'huge', 'latency']
+
+# remote host (a directory of the stand-in server) the files are transferred to/from
+REMOTE_HOST = 'bench.internal.net'
+
+# --bundle: the one command the stand-in server runs to unpack the bundles
+BUNDLE_POST_COMMAND = 'SITE EXEC tar -xf {file}'
+
+
+def scenario_files(scenario, args):
+    """
+    Function that returns the files of a scenario
+
+    Returns:
+    A tuple of the list of filenames, their size in bytes and the round-trip time (milliseconds) to emulate
+    """
+
+    if scenario == 'huge':
+        return [f'huge-{n}.dat' for n in range(1, args.huge_files + 1)], args.huge_size * 1024 * 1024, 0
+    count = args.small_files if scenario == 'small' else args.latency_files
+    latency = args.latency if scenario == 'latency' else 0
+    return [f'{scenario}-{n:05}.dat' for n in range(1, count + 1)], args.small_size * 1024, latency
+
+
+def write_files(directory, files, size):
+    """Function to write the files to be uploaded (random, so compression or dedup can't cheat)"""
+
+    directory.mkdir(parents=True, exist_ok=True)
+    for filename in files:
+        with open(directory / filename, 'wb') as f:
+            remaining = size
+            while remaining:
+                block = os.urandom(min(remaining, 1024 * 1024))
+                f.write(block)
+                remaining -= len(block)
+
+
+def start_server(root, latency):
+    """
+    Function to start ftpserver.py in its own process (so it doesn't count in the client's CPU time)
+
+    Returns:
+    A tuple of the subprocess.Popen object and the port it listens on
+    """
+
+    server = subprocess.Popen([sys.executable, str(BENCHMARKS_DIR / 'ftpserver.py'), '--root', str(root),
+                               '--latency', str(latency)], stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line.startswith('listening on'):
+        server.kill()
+        raise RuntimeError(f'ftpserver.py did not start: {line!r}')
+    return server, int(line.rsplit(':', 1)[1])
+
+
+def run_transfer(spec):
+    """
+    Function (run in a fresh process, see --child) to transfer the files of one scenario with fts.py
+
+    Arguments:
+    spec (dict): script, port, action, files, local_dir, engine, parallel, blocksize, socket_buffer, bundle
+
+    Returns:
+    A dictionary of the measures: seconds, cpu_seconds, peak_rss_mib and ok
+    """
+
+    module_spec = importlib.util.spec_from_file_location('fts', spec['script'])
+    fts = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(fts)
+
+    fts.GATEWAY_PORT = spec['port']
+    fts.METRICS.logger = None
+
+    logger = logging.getLogger('benchmark')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    # only passed when asked for, so an older fts.py (--script) without it can still be measured
+    options = {'bundle_post_command': BUNDLE_POST_COMMAND} if spec['bundle'] else {}
+
+    connection_class = fts.AsyncFtpConnection if spec['engine'] == 'async' else fts.FtpConnection
+    FTP = connection_class('127.0.0.1', 'local', 'benchmark', 'password', 'ms', 'benchmark', spec['action'],
+                           spec['files'], REMOTE_HOST, 'benchmark', 'password', 'home', logger,
+                           parallel=spec['parallel'], show_progress=False, blocksize=spec['blocksize'],
+                           socket_buffer=spec['socket_buffer'], local_dir=spec['local_dir'], **options)
+
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    try:
+        FTP.connect_and_transfer()
+        ok = True
+    except SystemExit:
+        # fts.py ends with sys.exit() (TerminateTheScript) when any file failed
+        ok = False
+    seconds = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    # ru_maxrss is in KiB on Linux, in bytes on macOS
+    peak_rss = after.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+    return {'seconds': seconds, 'ok': ok and all(size is not None for size in FTP.results.values()),
+            'cpu_seconds': (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime),
+            'peak_rss_mib': round(peak_rss, 1)}
+
+
+def run_scenario(scenario, args, work_dir):
+    """
+    Function to run one scenario: write its files, upload them, then download them back
+
+    Returns:
+    A list of the results (one per action)
+    """
+
+    files, size, latency = scenario_files(scenario, args)
+    upload_dir = work_dir / 'upload' / scenario
+    download_dir = work_dir / 'download' / scenario
+    write_files(upload_dir, files, size)
+    download_dir.mkdir(parents=True)
+
+    server, port = start_server(work_dir / 'remote', latency)
+    results = []
+    try:
+        for action, local_dir in (('upload', upload_dir), ('download', download_dir)):
+            spec = {'script': str(args.script), 'port': port, 'action': action, 'files': files,
+                    'local_dir': str(local_dir), 'engine': args.engine, 'parallel': args.parallel,
+                    'blocksize': args.blocksize, 'socket_buffer': args.socket_buffer, 'bundle': args.bundle}
+            child = subprocess.run([sys.executable, __file__, '--child', json.dumps(spec)],
+                                   stdout=subprocess.PIPE, text=True, check=True)
+            measures = json.loads(child.stdout.splitlines()[-1])
+
+            nbytes = len(files) * size
+            if action == 'download':
+                # a download only counts if every file came back whole
+                measures['ok'] = measures['ok'] and all(
+                    (local_dir / filename).stat().st_size == size for filename in files if (local_dir / filename).exists())
+
+            result = {'scenario': scenario, 'action': action, 'files': len(files), 'bytes': nbytes,
+                      'latency_ms': latency, **measures,
+                      'mb_per_second': round(nbytes / measures['seconds'] / 1e6, 2),
+                      'files_per_second': round(len(files) / measures['seconds'], 1)}
+            results.append(result)
+            print_result(result)
+    finally:
+        server.kill()
+        server.wait()
+
+    return results
+
+
+def print_result(result, other=None):
+    line = (f'{result["scenario"]:<8} {result["action"]:<8} {result["files"]:>6} files  '
+            f'{result["mb_per_second"]:>9.2f} MB/s  {result["files_per_second"]:>8.1f} files/s  '
+            f'cpu {result["cpu_seconds"]:>7.2f}s  rss {result["peak_rss_mib"]:>7.1f} MiB'
+            f'{"" if result["ok"] else "  FAILED"}')
+    if other:
+        line += f'  ({result["mb_per_second"] / other["mb_per_second"] - 1:+.0%} MB/s, ' \
+                f'{result["cpu_seconds"] / max(other["cpu_seconds"], 1e-6) - 1:+.0%} cpu)'
+    print(line)
+
+
+def compare(before_file, after_file):
+    """Function to print the results of 2 runs side by side (after relative to before)"""
+
+    before, after = (json.loads(Path(file).read_text()) for file in (before_file, after_file))
+    for run, file in ((before, before_file), (after, after_file)):
+        print(f'{file}: {", ".join(f"{key} {value}" for key, value in run["settings"].items())}')
+
+    previous = {(result['scenario'], result['action']): result for result in before['results']}
+    for result in after['results']:
+        print_result(result, previous.get((result['scenario'], result['action'])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark of the fts.py transfers against a local stand-in Unix gate')
+    parser.add_argument('--script', type=Path, default=DEFAULT_SCRIPT, help='fts.py to benchmark')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS, help='scenarios to run (default all)')
+    parser.add_argument('--engine', choices=['ftplib', 'async'], default='ftplib', help='transfer engine (default ftplib)')
+    parser.add_argument('--parallel', type=int, default=1, help='gateway sessions (default 1)')
+    parser.add_argument('--blocksize', type=int, default=64 * 1024, help='bytes per block (default 65536)')
+    parser.add_argument('--socket-buffer', type=int, default=None, help='SO_SNDBUF/SO_RCVBUF of the data connections')
+    parser.add_argument('--bundle', action='store_true', help='upload the small files as tar bundles (fts.py --bundle)')
+    parser.add_argument('--small-files', type=int, default=500, help='files of the small scenario (default 500)')
+    parser.add_argument('--small-size', type=int, default=4, help='KiB per small file (default 4)')
+    parser.add_argument('--huge-files', type=int, default=2, help='files of the huge scenario (default 2)')
+    parser.add_argument('--huge-size', type=int, default=128, help='MiB per huge file (default 128)')
+    parser.add_argument('--latency-files', type=int, default=50, help='files of the latency scenario (default 50)')
+    parser.add_argument('--latency', type=float, default=40, help='round-trip time (ms) of the latency scenario (default 40)')
+    parser.add_argument('--output', type=Path, help=f'JSON file of the results (default: {RESULTS_DIR}/<date-time>.json)')
+    parser.add_argument('--compare', nargs=2, type=Path, metavar=('BEFORE', 'AFTER'), help='compare the results of 2 runs')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_transfer(json.loads(args.child))))
+        return
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    args.script = args.script.resolve()
+    settings = {'engine': args.engine, 'parallel': args.parallel, 'blocksize': args.blocksize,
+                'socket_buffer': args.socket_buffer, 'bundle': args.bundle}
+    print(f'{args.script}: {", ".join(f"{key} {value}" for key, value in settings.items())}')
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='fts-benchmark-') as work_dir:
+        for scenario in args.scenarios:
+            results.extend(run_scenario(scenario, args, Path(work_dir)))
+
+    output = args.output or RESULTS_DIR / f'{datetime.datetime.now():%Y%m%d-%H%M%S}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                                  'python': platform.python_version(), 'platform': platform.platform(),
+                                  'script': str(args.script), 'settings': settings,
+                                  'scenario_settings': {key: getattr(args, key) for key in (
+                                      'small_files', 'small_size', 'huge_files', 'huge_size', 'latency_files', 'latency')},
+                                  'results': results}, indent=2))
+    print(f'Results saved in {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -16,21 +16,101 @@ FTP password, client ID).
 
 import json
 import argparse
+import importlib.util
+import atexit
 import logging
-import logging.config
 import math
-import getpass
-import csv
+import io
 import ftplib
+import fnmatch
+import glob
 import contextlib
+import os
 import sys
 import threading
+import queue
+import socket
+import stat
 import datetime
 import time
-from pprint import pprint
+import itertools
+import random
+import posixpath
+import zlib
 from pathlib import Path
 
 
+def lazy_import(name):
+    """
+    Function to import a module only when one of its attributes is first used, so the modules that
+    only some runs need (e.g. asyncio for --engine async) don't slow down the start up of every run
+
+    Arguments:
+    name (str): Module name
+
+    Returns:
+    The module (loaded on first use), or None if it is not installed
+    """
+
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return None
+
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+
+    # a submodule (e.g. logging.handlers) is also an attribute of its package, as the import statement does
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+def preload(module):
+    """
+    Function to load a lazy_import module right away. LazyLoader isn't thread-safe, so a module that
+    several threads (e.g. --parallel sessions) may use for the first time at once is loaded before they start.
+
+    Arguments:
+    module (module object): Module returned by lazy_import (None if it is not installed)
+    """
+
+    if module is not None:
+        # any attribute does, the first one used loads the module
+        module.__name__
+
+
+# only needed by some runs: the asyncio engine, the config cache, the rotation of the log file,
+# the bundles of small files (--bundle), the checksums (--verify), the daemon and the metrics endpoint,
+# the queued log writer, the CSV files and the password prompt (--help needs none of them).
+# The first use of each has to be on one thread at a time (see preload)
+asyncio = lazy_import('asyncio')
+pickle = lazy_import('pickle')
+gzip = lazy_import('gzip')
+tarfile = lazy_import('tarfile')
+hashlib = lazy_import('hashlib')
+socketserver = lazy_import('socketserver')
+signal = lazy_import('signal')
+lazy_import('logging.handlers')
+csv = lazy_import('csv')
+getpass = lazy_import('getpass')
+
+# optional, only needed for --compress zstd
+zstandard = lazy_import('zstandard')
+
+try:
+    # POSIX only, needed for the type-ahead filter of the user menus (read key by key)
+    import termios
+    import tty
+except ImportError:
+    termios = None
+
+
 # global variables and constants
 VERSION_NO = '1.0'
 BUILD_DATE = '2019/06/19'
@@ -44,6 +124,11 @@ LOG_DIR = curr_dir / 'logs'
 CONFIG_DIR = curr_dir / 'config'
 JSON_CONFIG = 'fts.json'
 
+# the parsed CSV files, reused as long as none of them changed (size and modification time)
+CONFIG_CACHE = CONFIG_DIR / '.fts-config.cache'
+# bumped whenever what's cached changes shape, so the caches of older versions are parsed again
+CONFIG_CACHE_VERSION = 2
+
 # FileHandler (asctime) will include the date and time stamps
 FORMATTER = logging.Formatter(
     fmt='%(asctime)s - %(levelname)s - %(message)s', datefmt='%I:%M:%S %p')
@@ -51,6 +136,79 @@ FORMATTER = logging.Formatter(
 
 LOG_FILE = LOG_DIR / 'fts.log'
 
+# the log file is written by a background thread (see start_log_writer) fed through LOG_QUEUE, so logging
+# never waits on the disk; it's rotated at LOG_MAX_BYTES (or daily) and the LOG_BACKUP_COUNT old ones are gzipped
+LOG_QUEUE = queue.Queue()
+LOG_LISTENER = None
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# ftplib's default is 8 KiB per block, which badly limits throughput on high-latency gateway links
+DEFAULT_BLOCKSIZE = 64 * 1024
+
+# uploads hand the file to the kernel (sendfile) this many bytes at a time, so progress keeps on being reported
+SENDFILE_CHUNK = 1024 * 1024
+
+# downloads are written to <file>.fts-part through a buffer of this size, and renamed once complete
+PARTIAL_SUFFIX = '.fts-part'
+WRITE_BUFFER = 1024 * 1024
+
+# --compress: suffix of the compressed remote file per codec
+COMPRESS_SUFFIX = {'gzip': '.gz', 'zstd': '.zst'}
+
+# sidecar file (next to the local file) that records how far an interrupted transfer got
+RESUME_SUFFIX = '.fts-resume'
+
+# --bundle: uploads up to BUNDLE_FILE_SIZE bytes go as one tar stream (see bundle_post_command in the JSON file)
+# per BUNDLE_MAX_FILES files, named fts-bundle-<pid>-<number>.tar on the remote host until they're unpacked
+BUNDLE_FILE_SIZE = 1024 * 1024
+BUNDLE_MAX_FILES = 1000
+BUNDLE_NUMBER = itertools.count(1)
+
+# files up to this size are transferred back to back, the data connection of the next one being asked
+# for while the reply that ends the transfer is on its way (see GatewayFTP.transfer_queued)
+PIPELINE_FILE_SIZE = 1024 * 1024
+
+# FTP port of the Unix gates (the benchmarks point it to a local stand-in, see benchmarks/ftpserver.py)
+GATEWAY_PORT = ftplib.FTP_PORT
+
+# daemon mode: unix domain sockets (one per gateway) the daemon listens on for transfer jobs,
+# and how often (in seconds) its idle gateway sessions are kept alive with a NOOP
+DAEMON_DIR = Path.home() / '.fts'
+KEEPALIVE_INTERVAL = 60
+# what a job submitted to the daemon has to carry (see submit_to_daemon and parse_daemon_job)
+DAEMON_JOB_KEYS = ('server_grp', 'ms_instance', 'action', 'files', 'remote_host', 'remote_user', 'remote_pwd',
+                   'remote_dir', 'local_dir', 'parallel', 'blocksize', 'resume', 'segments', 'compress',
+                   'compress_post_command', 'sync', 'verify', 'retries', 'retry_backoff', 'rate_limit',
+                   'bundle_post_command')
+
+# files smaller than this (per segment) are not worth splitting across gateway sessions
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+
+# --verify: remote checksum file used when the server can't hash files
+CHECKSUM_SUFFIX = '.sha256'
+
+# a file that fails with a transient error (4xx, lost connection) or a checksum mismatch is transferred
+# again up to DEFAULT_RETRIES times, waiting about 2, 4, 8... seconds (at most RETRY_BACKOFF_MAX) in between
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 2
+RETRY_BACKOFF_MAX = 60
+
+# menus with at least this many choices are filtered as the user types instead of listed in full,
+# showing (at most) this many rows of matches
+TYPEAHEAD_MIN_CHOICES = 50
+TYPEAHEAD_ROWS = 10
+
+# bandwidth limit (bytes per second) of every gateway in use by this process, shared by all of its transfers
+RATE_LIMITERS = {}
+RATE_LIMITERS_LOCK = threading.Lock()
+
+# timings and bytes of every login and file transfer, one JSON object per line (see TransferMetrics) handed
+# to the log writer thread through METRICS_LOGGER, and rotated like the log file;
+# daemon and batch runs can also serve their totals on http://127.0.0.1:<--metrics-port>/metrics
+METRICS_FILE = LOG_DIR / 'fts_metrics.jsonl'
+METRICS_LOGGER = 'fts.metrics'
+
 
 class Error(Exception):
     """Base class for exceptions"""
@@ -125,263 +283,3503 @@ class WeGotOurselvesAQuitter(Error):
         raise TerminateTheScript(self.logger)
 
 
-class ConfigDoesNotExistError(Error):
-    """Exception raised if one of the configuration directories and/or files does not exist
+class ConfigDoesNotExistError(Error):
+    """Exception raised if one of the configuration directories and/or files does not exist
+
+    Attributes:
+    logger (logging.Logger object) - Object that handles the FileHandler and StreamHandler
+    config (str) - Missing configuration (directory or file)
+    """
+
+    def __init__(self, logger, config):
+        self.config = config
+        self.logger = logger
+
+        self.logger.error(f'{self.config} does not exist!')
+        raise TerminateTheScript(self.logger)
+
+
+class UploadFileDoesNotExistError(Error):
+    """Exception raised if the file to be uploaded does not exist
+
+    Attributes:
+    logger(logging.Logger object) - Object that handles the FileHandler and StreamHandler
+    file(Path object)
+    """
+
+    def __init__(self, logger, file, curr_dir):
+        self.file = file
+        self.curr_dir = curr_dir
+        self.logger = logger
+
+        self.logger.error(f'{self.file} does not exist in {self.curr_dir}')
+        self.logger.info(dash_line)
+        raise TerminateTheScript(self.logger)
+
+
+class TerminateTheScript(Error):
+    """Exception raised from the other custom exceptions to prematurely end the script
+
+    Attribute:
+    logger(logging.Logger object) - object that handles the FileHandler and StreamHandler
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+
+        self.logger.warning('Terminating script...')
+        self.logger.info('End of program')
+        self.logger.info(f'Logged everything in {LOG_FILE}')
+        self.logger.info('Thank you for using the script!')
+        self.logger.info(f'END - {t()}')
+        self.logger.info(equal_sign_line)
+        sys.exit()
+
+
+class ChecksumMismatchError(ftplib.error_perm):
+    """
+    Raised (--verify) when the checksum of a transferred file doesn't match the remote one.
+    An ftplib.error_perm, since the session itself is still fine and can transfer the file again.
+    """
+
+
+class GatewayFTP(ftplib.FTP):
+    """
+    ftplib.FTP that tunes the send/receive buffers (SO_SNDBUF/SO_RCVBUF) of every
+    data connection it opens for RETR/STOR, and saves the round trips it can from one
+    transfer to the next (the repeated TYPE I, waiting on the reply to every command)
+
+    Attributes:
+    socket_buffer (int): Buffer size in bytes; None (or 0) leaves it to the OS auto-tuning
+    logger (logging.Logger object): Gets the buffer sizes the OS refused, at debug level; None to not log them
+    rate_limiter (RateLimiter object): Bandwidth limit the data connections are paced to; None for no limit
+    recycled (bool): Already used for another remote host, given back to the pool after a REIN
+    pipeline (bool): The gate takes pipelined commands; turned off for good as soon as a pipelined PASV or
+                     transfer fails
+    transfer_queued (bool): Set by the caller before a transfer that another one follows right after (no other
+                            command in between, e.g. a batch of small files): the next data connection (PASV) is
+                            then asked for as soon as this one is closed, without waiting for the reply that ends
+                            the transfer, and connected while its RETR/STOR is sent
+    pasv_sent (bool): A PASV was sent ahead (pipeline) and its reply is still to be read
+    pipelined (bool): The current transfer uses the PASV sent ahead
+    transfer_type (str): Last TYPE command sent, so the one before every transfer can be skipped
+    """
+
+    def __init__(self, host='', socket_buffer=None, rate_limiter=None, logger=None, **kwargs):
+        self.socket_buffer = socket_buffer
+        self.logger = logger
+        self.rate_limiter = rate_limiter
+        self.hash_support = None
+        self.recycled = False
+        self.pipeline = True
+        self.transfer_queued = False
+        self.pasv_sent = False
+        self.pasv_next = False
+        self.pipelined = False
+        self.transfer_type = None
+        self.port = GATEWAY_PORT
+        super().__init__(host, **kwargs)
+
+
+    def putcmd(self, line):
+        if self.pasv_sent:
+            # the PASV sent ahead wasn't used (e.g. a SIZE or QUIT came next), its reply comes first
+            self.pasv_sent = False
+            with contextlib.suppress(ftplib.Error):
+                self.getresp()
+
+        command = line.split(' ', 1)[0].upper()
+        if command == 'TYPE':
+            self.transfer_type = line
+        elif command in ('USER', 'REIN'):
+            # a new login starts over in ASCII
+            self.transfer_type = None
+
+        super().putcmd(line)
+
+
+    def close(self):
+        if self.pasv_sent and self.sock:
+            # read the reply to the PASV sent ahead, closing with unread data would reset the connection
+            self.pasv_sent = False
+            with contextlib.suppress(*ftplib.all_errors):
+                self.sock.settimeout(5)
+                self.getresp()
+
+        super().close()
+
+
+    def voidcmd(self, cmd):
+        # ftplib sends TYPE I before every RETR/STOR, a round trip per file even though it hardly ever changes
+        if cmd == self.transfer_type:
+            return '200 Type unchanged'
+        return super().voidcmd(cmd)
+
+
+    def voidresp(self):
+        if not self.pasv_next:
+            return super().voidresp()
+
+        # the reply that ends a transfer
+        self.pasv_next = False
+        pipelined = self.pipelined or (self.pipeline and self.transfer_queued)
+        if self.pipeline and self.transfer_queued:
+            # the data connection is closed and the next transfer is coming: ask for its data connection now,
+            # the reply comes right after the one that ends this transfer (no extra round trip)
+            super().putcmd('PASV' if self.af == socket.AF_INET else 'EPSV')
+            self.pasv_sent = True
+        self.transfer_queued = False
+        self.pipelined = False
+
+        try:
+            return super().voidresp()
+        except ftplib.Error:
+            if pipelined:
+                # in case the gate failed the transfer over the pipelined commands, don't do it again
+                self.pipeline = False
+            raise
+
+
+    def makepasv(self):
+        if not self.pasv_sent:
+            return super().makepasv()
+
+        self.pasv_sent = False
+        try:
+            reply = self.getresp()
+        except (ftplib.error_perm, ftplib.error_temp):
+            # the gate doesn't take a command before the transfer is over, ask afterwards from now on
+            self.pipeline = False
+            return super().makepasv()
+
+        # same as ftplib, connect to the control connection's host rather than the address in the 227 reply
+        if self.af == socket.AF_INET:
+            return self.sock.getpeername()[0], ftplib.parse227(reply)[1]
+        return ftplib.parse229(reply, self.sock.getpeername())
+
+
+    def set_buffers(self, sock):
+        """
+        Class method to set the send/receive buffers of a data socket. The window scaling of a TCP connection
+        is agreed on in the handshake, so it has to be done before connect() (or listen() for PORT).
+
+        Arguments:
+        sock (socket object): Socket that isn't connected yet
+        """
+
+        if not self.socket_buffer:
+            return
+
+        for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, option, self.socket_buffer)
+            except OSError as e:
+                # the OS auto-tuning is used instead, not worth failing the transfer over it
+                if self.logger:
+                    self.logger.debug(f'Socket buffer of {self.socket_buffer} bytes not set ({e})')
+
+
+    def makeport(self):
+        sock = super().makeport()
+        # the accepted data connection gets the buffers of the listening socket
+        self.set_buffers(sock)
+        return sock
+
+
+    def connect_data(self, host, port):
+        """
+        Class method to open a passive data connection, same as socket.create_connection but with the
+        buffers set before connecting
+
+        Arguments:
+        host (str): Host of the PASV/EPSV reply
+        port (int): Port of the PASV/EPSV reply
+
+        Returns:
+        The connected socket object
+        """
+
+        error = None
+        for af, socktype, proto, _, address in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+            sock = socket.socket(af, socktype, proto)
+            try:
+                self.set_buffers(sock)
+                if isinstance(self.timeout, (int, float)):
+                    sock.settimeout(self.timeout)
+                if self.source_address:
+                    sock.bind(self.source_address)
+                sock.connect(address)
+                return sock
+            except OSError as e:
+                error = e
+                sock.close()
+
+        raise error or OSError(f'No address found for {host}')
+
+
+    def ntransfercmd(self, cmd, rest=None):
+        if not self.passiveserver:
+            conn, size = super().ntransfercmd(cmd, rest)
+        else:
+            # a transfer of a batch (see transfer_queued) that got its PASV sent ahead is pipelined too
+            pipelined = self.pasv_sent and self.pipeline
+            host, port = self.makepasv()
+            if rest is not None:
+                self.sendcmd(f'REST {rest}')
+
+            if pipelined and self.pipeline:
+                # send the command while connecting, instead of waiting for the connection first (one round trip less)
+                self.putcmd(cmd)
+                try:
+                    conn = self.connect_data(host, port)
+                except OSError:
+                    self.pipeline = False
+                    with contextlib.suppress(ftplib.Error):
+                        self.getresp()
+                    raise
+            else:
+                pipelined = False
+                conn = self.connect_data(host, port)
+                self.putcmd(cmd)
+
+            try:
+                resp = self.getresp()
+                if resp[0] == '2':
+                    # some servers answer 200 (or 225) before the 150
+                    resp = self.getresp()
+                if resp[0] != '1':
+                    raise ftplib.error_reply(resp)
+            except BaseException:
+                if pipelined:
+                    self.pipeline = False
+                conn.close()
+                raise
+
+            self.pipelined = pipelined
+
+            size = ftplib.parse150(resp) if resp[:3] == '150' else None
+
+        self.pasv_next = True
+        return conn, size
+
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        if self.rate_limiter:
+            limiter, write_block = self.rate_limiter, callback
+
+            # not reading the next block until it's our turn makes TCP slow down the sender too
+            def callback(block):
+                limiter.consume(len(block))
+                write_block(block)
+
+        return super().retrbinary(cmd, callback, blocksize=blocksize, rest=rest)
+
+
+    def storbinary(self, cmd, fp, blocksize=8192, callback=None, rest=None):
+        if self.rate_limiter:
+            limiter, sent_block = self.rate_limiter, callback
+
+            def callback(block):
+                limiter.consume(len(block))
+                if sent_block:
+                    sent_block(block)
+
+        return super().storbinary(cmd, fp, blocksize=blocksize, callback=callback, rest=rest)
+
+
+    def storfile(self, cmd, fp, blocksize=DEFAULT_BLOCKSIZE, callback=None, rest=None):
+        """
+        Class method to upload a file like storbinary does, but with socket.sendfile() (the kernel's
+        sendfile(2)) straight from the file descriptor instead of reading every block through Python.
+        Falls back to storbinary's buffered loop if the OS has no sendfile or fp is not a regular file.
+
+        Arguments:
+        cmd (str): STOR (or APPE) command
+        fp (file object): File opened in binary mode, positioned where the upload starts
+        blocksize (int): Block size of the buffered loop
+        callback (function): Called with the number of bytes sent after every chunk
+        rest (int): Offset passed to REST
+
+        Returns:
+        The server's reply
+        """
+
+        try:
+            regular_file = stat.S_ISREG(os.fstat(fp.fileno()).st_mode)
+        except (AttributeError, OSError, ValueError):
+            regular_file = False
+
+        if not hasattr(os, 'sendfile') or not regular_file:
+            return self.storbinary(cmd, fp, blocksize=blocksize, rest=rest,
+                                   callback=(lambda block: callback(len(block))) if callback else None)
+
+        # with a bandwidth limit, hand the kernel a block at a time so the pacing stays smooth
+        chunk = blocksize if self.rate_limiter else max(blocksize, SENDFILE_CHUNK)
+
+        self.voidcmd('TYPE I')
+        with self.transfercmd(cmd, rest) as conn:
+            offset = fp.tell()
+            while True:
+                sent = conn.sendfile(fp, offset, chunk)
+                if not sent:
+                    break
+                offset += sent
+                if self.rate_limiter:
+                    self.rate_limiter.consume(sent)
+                if callback:
+                    callback(sent)
+
+        return self.voidresp()
+
+
+    def hash_method(self):
+        """
+        Class method to find out (from FEAT, once per session) how the remote host can hash a file
+
+        Returns:
+        Tuple of the command (HASH, XSHA256, XSHA1, XMD5 or XCRC) and the hashlib name of its algorithm
+        (sha256, sha1, md5 or crc32); None if the remote host can't hash files
+        """
+
+        if self.hash_support is not None:
+            return self.hash_support or None
+
+        self.hash_support = ()
+        try:
+            features = [line.strip().upper() for line in self.sendcmd('FEAT').splitlines()[1:-1]]
+        except ftplib.error_perm:
+            return None
+
+        for feature in features:
+            name, _, params = feature.partition(' ')
+            if name != 'HASH':
+                continue
+            algorithms = params.split(';')
+            for algorithm in ('SHA-256', 'SHA-1', 'MD5'):
+                # the one marked with * is the server's current choice, any other one has to be selected
+                if algorithm in algorithms:
+                    self.sendcmd(f'OPTS HASH {algorithm}')
+                elif f'{algorithm}*' not in algorithms:
+                    continue
+                self.hash_support = ('HASH', algorithm.replace('-', '').lower())
+                return self.hash_support
+
+        names = [feature.partition(' ')[0] for feature in features]
+        for command, algorithm in (('XSHA256', 'sha256'), ('XSHA1', 'sha1'), ('XMD5', 'md5'), ('XCRC', 'crc32')):
+            if command in names:
+                self.hash_support = (command, algorithm)
+                return self.hash_support
+
+        return None
+
+
+    def remote_hash(self, filename):
+        """Class method that returns the checksum (lowercase hex) of a remote file, computed by the remote host"""
+
+        command, algorithm = self.hash_method()
+        reply = self.sendcmd(f'{command} {filename}')
+
+        # e.g. "213 SHA-256 0-1234 <hex> file" for HASH, "250 <hex>" for the X commands
+        digits = len(new_hasher(algorithm).hexdigest())
+        for token in reply[4:].split():
+            if len(token) == digits and all(c in '0123456789abcdefABCDEF' for c in token):
+                return token.lower()
+
+        raise ftplib.error_reply(f'Unexpected reply to {command}: {reply}')
+
+
+class RateLimiter():
+    """
+    Token bucket (in its GCRA form) that paces every transfer through a gateway to a bandwidth limit.
+    Each block reserves the next slot right after the previous reservation, so concurrent transfers
+    take turns block by block (a fair share each) and the total stays at the limit without bursts.
+
+    Attributes:
+    rate (int): Limit in bytes per second
+    burst (int): Bytes that may go through without waiting after an idle period
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(DEFAULT_BLOCKSIZE, rate // 10)
+        self.lock = threading.Lock()
+        # theoretical arrival time: when the bytes reserved so far will have gone through at the limit
+        self.tat = time.monotonic()
+
+
+    def reserve(self, nbytes):
+        """
+        Class method to reserve the bandwidth for nbytes
+
+        Returns:
+        Seconds to wait before the bytes are within the limit
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            tat = max(self.tat, now)
+            self.tat = tat + nbytes / self.rate
+            return max(0.0, self.tat - now - self.burst / self.rate)
+
+
+    def consume(self, nbytes):
+        time.sleep(self.reserve(nbytes))
+
+
+class TransferMetrics():
+    """
+    Records how long the gateway logins, remote host logins, file transfers (RETR/STOR) and whole runs
+    take, and how many bytes went through. Each one is logged as a JSON line (the log writer thread
+    writes them to METRICS_FILE, see start_log_writer), and totalled per set of labels
+    (e.g. gateway, host, action, status) for the /metrics endpoint.
+
+    Attributes:
+    logger (logging.Logger object): Logger of the JSON lines; None keeps the totals only
+    totals (dict): (event, labels) as key, list of count, seconds and bytes as value
+    """
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.totals = {}
+        self.lock = threading.Lock()
+
+
+    def record(self, event, seconds, labels, nbytes=None, **details):
+        """
+        Class method to record one event
+
+        Arguments:
+        event (str): login_gateway, login_remote_host, transfer or run
+        seconds (float): How long it took
+        labels (dict): What the event is totalled by (kept few, e.g. no file names)
+        nbytes (int): Bytes transferred, if any
+        details (dict): Anything else for the JSON line only (e.g. file, attempts)
+        """
+
+        line = {'time': datetime.datetime.now().isoformat(timespec='milliseconds'), 'event': event,
+                'seconds': round(seconds, 6), **labels, **details}
+        if nbytes is not None:
+            line['bytes'] = nbytes
+            line['bytes_per_second'] = round(nbytes / seconds) if seconds else None
+
+        with self.lock:
+            total = self.totals.setdefault((event, tuple(sorted(labels.items()))), [0, 0.0, 0])
+            total[0] += 1
+            total[1] += seconds
+            total[2] += nbytes or 0
+
+        # queued like the log records, the transfer threads never wait on the disk
+        if self.logger:
+            self.logger.info(json.dumps(line))
+
+
+    @contextlib.contextmanager
+    def timed(self, event, labels, **details):
+        """
+        Class method (context manager) to record how long the block inside takes,
+        with a status label of ok, or failed if it raised an exception
+        """
+
+        start = time.perf_counter()
+        status = 'failed'
+        try:
+            yield
+            status = 'ok'
+        finally:
+            self.record(event, time.perf_counter() - start, dict(labels, status=status), **details)
+
+
+    def exposition(self):
+        """
+        Class method that formats the totals for the /metrics endpoint (Prometheus text format)
+
+        Returns:
+        A string with a count, sum of seconds and (for the transfers) total bytes per event and labels
+        """
+
+        with self.lock:
+            totals = sorted((event, labels, list(total)) for (event, labels), total in self.totals.items())
+
+        lines = []
+        for event in sorted({event for event, labels, total in totals}):
+            lines.append(f'# TYPE fts_{event}_seconds summary')
+            for name, labels, (count, seconds, nbytes) in totals:
+                if name == event:
+                    lines.append(f'fts_{event}_seconds_count{format_labels(labels)} {count}')
+                    lines.append(f'fts_{event}_seconds_sum{format_labels(labels)} {seconds:.6f}')
+
+            if event in ('transfer', 'run'):
+                lines.append(f'# TYPE fts_{event}_bytes_total counter')
+                for name, labels, (count, seconds, nbytes) in totals:
+                    if name == event:
+                        lines.append(f'fts_{event}_bytes_total{format_labels(labels)} {nbytes}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# every connection of this process records into the same metrics
+METRICS = TransferMetrics(logging.getLogger(METRICS_LOGGER))
+
+
+class MenuIndex():
+    """
+    Substring index of a user menu (for the type-ahead filter of ask_user), built once: every 1, 2 and 3
+    character sequence of a value points to the menu keys whose value contains it, so a query only looks
+    at the values that contain all of its trigrams instead of going through the whole menu
+
+    Attributes:
+    menu_dict (dict): Menu number as key, value to display as value
+    """
+
+    def __init__(self, menu_dict):
+        self.menu_dict = menu_dict
+        self.values = {key: str(value).lower() for key, value in menu_dict.items()}
+        self.grams = {}
+        for key, value in self.values.items():
+            for n in (1, 2, 3):
+                for i in range(len(value) - n + 1):
+                    self.grams.setdefault(value[i:i + n], set()).add(key)
+        self.last = ('', list(menu_dict))
+
+
+    def search(self, query):
+        """
+        Class method to find the menu entries that contain query (case-insensitive). A query that only got longer
+        (the usual keystroke) is looked up in the previous matches, anything else goes through the index.
+
+        Returns:
+        List of menu keys: the one numbered query (if any), then the values starting with query, then the others
+        """
+
+        query = query.lower()
+        last_query, last_keys = self.last
+
+        if not query:
+            keys = list(self.menu_dict)
+        elif last_query and last_query in query:
+            keys = [key for key in last_keys if query in self.values[key]]
+        else:
+            grams = [query[i:i + 3] for i in range(len(query) - 2)] or [query]
+            candidates = set.intersection(*(self.grams.get(gram, set()) for gram in grams))
+            # the trigrams may be there in another order, so check the whole query
+            keys = [key for key in sorted(candidates) if query in self.values[key]]
+
+        self.last = (query, keys)
+
+        ranked = [key for key in keys if self.values[key].startswith(query)]
+        ranked += [key for key in keys if not self.values[key].startswith(query)]
+
+        if query.isdigit() and int(query) in self.menu_dict:
+            number = int(query)
+            ranked = [number] + [key for key in ranked if key != number]
+
+        return ranked
+
+
+class HashingReader():
+    """
+    Read-only file-like object that updates a checksum with everything read through it (e.g. by storbinary)
+
+    Attributes:
+    fp (file object): File opened in binary mode
+    hasher (hashlib object): Checksum to update
+    """
+
+    def __init__(self, fp, hasher):
+        self.fp = fp
+        self.hasher = hasher
+
+
+    def read(self, size=-1):
+        data = self.fp.read(size)
+        self.hasher.update(data)
+        return data
+
+
+class Crc32():
+    """hashlib-like CRC-32 (for the XCRC command)"""
+
+    name = 'crc32'
+
+    def __init__(self):
+        self.crc = 0
+
+
+    def update(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+
+
+    def hexdigest(self):
+        return f'{self.crc:08x}'
+
+
+class CompressingReader():
+    """
+    Read-only file-like object that compresses another file on the fly as it's read
+    (e.g. by storbinary), so only about a block of compressed data is in memory at a time
+
+    Attributes:
+    fp (file object): Uncompressed file opened in binary mode
+    codec (str): 'gzip' or 'zstd'
+    callback (function): Called with the number of uncompressed bytes read from fp
+    size (int): Compressed bytes read so far
+    """
+
+    def __init__(self, fp, codec, callback=None):
+        self.fp = fp
+        self.callback = callback
+        self.compressor = new_compressor(codec)
+        self.buffer = bytearray()
+        self.eof = False
+        self.size = 0
+
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.buffer) < size) and not self.eof:
+            raw = self.fp.read(max(size, DEFAULT_BLOCKSIZE))
+            if raw:
+                self.buffer += self.compressor.compress(raw)
+                if self.callback:
+                    self.callback(len(raw))
+            else:
+                self.buffer += self.compressor.flush()
+                self.eof = True
+
+        size = len(self.buffer) if size < 0 else size
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.size += len(data)
+        return data
+
+
+class TarReader():
+    """
+    Read-only file-like object that packs files into a tar stream as it's read (e.g. by storbinary),
+    so only about a file of the stream is in memory at a time
+
+    Attributes:
+    files (iterator): Tuples of the local file (Path object) and its name in the archive
+    callback (function): Called with the size of every file once it's packed
+    size (int): Bytes of the tar stream read so far
+    """
+
+    def __init__(self, files, callback=None):
+        self.files = iter(files)
+        self.callback = callback
+        self.buffer = bytearray()
+        self.eof = False
+        self.size = 0
+        # the tar stream is written to this object (see write), and read back by the data connection
+        self.tar = tarfile.open(fileobj=self, mode='w|')
+
+
+    def write(self, data):
+        self.buffer += data
+
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.buffer) < size) and not self.eof:
+            entry = next(self.files, None)
+            if entry:
+                local_file, name = entry
+                self.tar.add(local_file, arcname=name, recursive=False)
+                if self.callback:
+                    self.callback(local_file.stat().st_size)
+            else:
+                self.tar.close()
+                self.eof = True
+
+        size = len(self.buffer) if size < 0 else size
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.size += len(data)
+        return data
+
+
+class TarBundle(str):
+    """
+    Remote name of a tar stream of small files uploaded in one go (--bundle), which is what
+    the transfer is retried, logged and recorded as
+
+    Attributes:
+    files (list): Tuples of the file (relative to the local and the remote directory) and its size in bytes
+    size (int): Total size (in bytes) of the files
+    """
+
+    def __new__(cls, files):
+        bundle = super().__new__(cls, f'fts-bundle-{os.getpid()}-{next(BUNDLE_NUMBER)}.tar')
+        bundle.files = files
+        bundle.size = sum(size for name, size in files)
+        return bundle
+
+
+class StreamDecompressor():
+    """
+    Decompresses a gzip or zstd stream block by block, as the blocks come in from retrbinary.
+    Concatenated gzip members or zstd frames (e.g. from gzip -c a b or zstd -c a b) are decompressed
+    one after another.
+
+    Attribute:
+    codec (str): 'gzip' or 'zstd'
+    eof (bool): The stream ended where a member/frame does, False for a truncated one
+    """
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.decompressor = new_decompressor(codec)
+
+
+    @property
+    def eof(self):
+        return self.decompressor.eof
+
+
+    def decompress(self, block):
+        data = b''
+
+        while block:
+            if self.decompressor.eof:
+                # the next member/frame (a zstd decompressobj can't be used past the end of its frame)
+                self.decompressor = new_decompressor(self.codec)
+            data += self.decompressor.decompress(block)
+            block = self.decompressor.unused_data if self.decompressor.eof else b''
+
+        return data
+
+
+    def flush(self):
+        flush = getattr(self.decompressor, 'flush', None)
+        return flush() if flush else b''
+
+
+class TransferProgress():
+    """
+    Progress bar driven by the byte counts handed to the retrbinary/storbinary callbacks.
+    Redraws are rate-limited so the transfer itself isn't slowed down by the console.
+
+    Original source of the bar: https://stackoverflow.com/a/15860757/1391441
+
+    Attributes:
+    total (int): Size (in bytes) of the file being transferred
+    enabled (bool): Determine if the progress bar will be displayed at all
+    done (int): Bytes transferred so far, including the bytes of a resumed transfer
+    """
+
+    BAR_LENGTH = 20
+    REFRESH_INTERVAL = 0.25
+
+    def __init__(self, total, enabled=True, initial=0):
+        self.total = total
+        self.enabled = enabled
+        self.done = initial
+        # bytes already there before this run (resumed transfer) don't count toward the rate
+        self.initial = initial
+        # segmented downloads update the same bar from several threads
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.last_draw = 0.0
+
+
+    def update(self, nbytes):
+        """Class method to add the bytes of the latest block and redraw the bar if it's time to"""
+
+        with self.lock:
+            self.done += nbytes
+            if not self.enabled:
+                return
+
+            now = time.monotonic()
+            if now - self.last_draw >= self.REFRESH_INTERVAL:
+                self.last_draw = now
+                self._draw(now)
+
+
+    def finish(self):
+        """Class method to draw the final state of the bar and move to the next line"""
+
+        if self.enabled:
+            self._draw(time.monotonic(), final=True)
+
+
+    def _draw(self, now, final=False):
+        elapsed = max(now - self.started, 1e-6)
+        rate = (self.done - self.initial) / elapsed
+        progress = min(self.done / self.total, 1.) if self.total else 1.
+
+        if final:
+            progress, status = 1., f' in {elapsed:.1f}s\r\n'
+        elif rate:
+            status = f' ETA {format_duration((self.total - self.done) / rate)}'
+        else:
+            status = ' ETA --:--'
+
+        block = int(round(self.BAR_LENGTH * progress))
+        text = (f'\r[{"#" * block + "-" * (self.BAR_LENGTH - block)}] {progress * 100:3.0f}% '
+                f'{format_size(self.done)} {format_size(rate)}/s{status}  ')
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+
+class FtpConnection():
+
+    def __init__(self, gateway, gate_location, gate_user, gate_pwd, server_grp, ms_instance, action, files, remote_host, remote_user, remote_pwd, remote_dir, logger, parallel=1, show_progress=True, blocksize=DEFAULT_BLOCKSIZE, socket_buffer=None, resume=False, segments=1, local_dir=None, pool=None, compress=None, compress_post_command=None, sync=False, verify=False, retries=DEFAULT_RETRIES, retry_backoff=DEFAULT_RETRY_BACKOFF, rate_limit=None, bundle_post_command=None):
+        self.gateway = gateway
+        self.gate_location = gate_location
+        self.gate_user = gate_user
+        self.gate_pwd = gate_pwd
+        self.server_grp = server_grp
+        self.ms_instance = ms_instance
+        self.action = action
+        self.files = files
+        self.remote_host = remote_host
+        self.remote_user = remote_user
+        self.remote_pwd = remote_pwd
+        self.remote_dir = remote_dir
+        self.logger = logger
+        self.host = f'MS host' if self.server_grp == 'ms' else f'non-MS host'
+        # number of gateway sessions to spread the file list across
+        self.parallel = max(1, parallel)
+        self.show_progress = show_progress
+        # size (in bytes) of every block read from/written to the data connection
+        self.blocksize = blocksize
+        self.socket_buffer = socket_buffer
+        # keep partial files and continue interrupted transfers where they left off; the files resumed
+        # are kept with the offset they were resumed at (bytes already there, not counted as transferred)
+        self.resume = resume
+        self.resumed = {}
+        # number of byte ranges (each over its own gateway session) a big download is split into
+        self.segments = max(1, segments)
+        self.segment_sessions = []
+        # local directory the files are downloaded to/uploaded from; current directory by default
+        self.local_dir = Path(local_dir) if local_dir else Path()
+        # GatewaySessionPool object (daemon mode) to take already authenticated gateway sessions from
+        self.pool = pool
+        # session of the single session transfers (not the --parallel ones)
+        self.ftp = None
+        # file as key, transferred bytes (or None if failed) as value
+        self.results = {}
+        # codec ('gzip' or 'zstd') to compress uploads / decompress downloads with on the fly, and the
+        # optional command (e.g. SITE EXEC gunzip {file}) sent after every compressed upload
+        self.compress = compress
+        self.compress_post_command = compress_post_command
+        # skip files whose remote (upload) or local (download) copy is already up to date; the remote
+        # directory listings (MLSD, one per directory) are cached, skipped files are kept with their size
+        self.sync = sync
+        self.remote_listing = {}
+        self.listing_lock = threading.Lock()
+        self.skipped = {}
+        # files actually queued once directories and glob patterns in self.files are expanded,
+        # and the remote directories already created (MKD) for the uploads
+        self.queued = []
+        self.remote_dirs = set()
+        # checksum every file while it's transferred and compare it with the remote one
+        self.verify = verify
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        # bandwidth limit shared with every other transfer through the same gateway
+        self.rate_limiter = gateway_rate_limiter(gateway, rate_limit) if rate_limit else None
+        # command (e.g. SITE EXEC tar -xf {file}) that unpacks a tar bundle of small uploads on the remote host;
+        # None to upload every file on its own
+        self.bundle_post_command = bundle_post_command
+
+
+    def connect_and_transfer(self):
+        """
+        Class method to login and transfer the files (see _connect_and_transfer),
+        recorded as a run in METRICS with the total bytes transferred
+        """
+
+        start = time.perf_counter()
+        status = 'failed'
+        try:
+            self._connect_and_transfer()
+            status = 'ok'
+        finally:
+            METRICS.record('run', time.perf_counter() - start, dict(self._metric_labels(), status=status),
+                           nbytes=sum(size for size in self.results.values() if size), files=len(self.results))
+
+
+    def _metric_labels(self):
+        """Class method that returns the labels of this connection's transfers in METRICS"""
+
+        return {'gateway': self.gateway, 'host': self.remote_host, 'action': self.action}
+
+
+    def _connect_and_transfer(self):
+        if self.parallel > 1 and (len(self.files) > 1 or any(self._expandable(entry) for entry in self.files)):
+            self._parallel_transfer()
+            return
+
+        if self.pool:
+            # daemon and batch runs: the gateway login (and its "VIP Access" approval) was already done by
+            # the pool, maybe even for another remote host (see GatewaySessionPool.release)
+            try:
+                self.ftp = self.pool.get()
+            except ftplib.all_errors:
+                raise GatewayConnectionError(
+                    self.logger, self.gateway, self.gate_location)
+
+            self.logger.info(f'Using an authenticated session to the {self.gate_location.title()} Gate ({self.gateway})')
+            self._login_to_remote_host()
+            return
+
+        self.logger.info(
+            f'Connecting to the {self.gate_location.title()} Gate ({self.gateway})...')
+
+        try:
+            with GatewayFTP(host=self.gateway, socket_buffer=self.socket_buffer, logger=self.logger) as ftp:
+                self.logger.info('Connection established!')
+                welcome = ftp.getwelcome()
+
+                if welcome:
+                    self.logger.info(
+                        f'A message from the server:\n{welcome}')
+
+                self.logger.info(
+                    'Please approve the push notification (sign-in request) in your "VIP Access" mobile app...')
+
+                # update Class attribute with the ftp object
+                self.ftp = ftp
+                # login to unix gate
+                self._login_to_gate()
+
+        except ftplib.all_errors as e:
+            raise GatewayConnectionError(
+                self.logger, self.gateway, self.gate_location)
+
+
+    def _login_to_gate(self):
+
+        try:
+            with METRICS.timed('login_gateway', {'gateway': self.gateway}):
+                self.ftp.login(user=self.gate_user, passwd=self.gate_pwd)
+            self.logger.info(f'User {self.gate_user} logged in')
+            self._login_to_remote_host()
+
+        except ftplib.all_errors:
+            raise GatewayConnectionError(
+                self.logger, self.gateway, self.gate_location)
+
+    def _login_to_remote_host(self):
+        self.ftp.rate_limiter = self.rate_limiter
+        # login to the chosen host (MS or non-MS)
+        try:
+            self.logger.info(f'Logging in to the {self.host}...')
+            self.ftp = self._login_remote(self.ftp)
+            self.logger.info(
+                f'Logged in: {self.remote_user}@{self.remote_host}')
+            self._transfer_files()
+            self._close_segment_sessions()
+            if self.ftp:
+                self._close_session(self.ftp)
+            self.logger.info('FTP connection closed')
+            self.logger.info('Disconnected from server')
+
+        except ftplib.all_errors:
+            if self.ftp:
+                self._close_session(self.ftp, alive=False)
+            raise RemoteHostConnectionError(
+                self.logger, self.remote_user, self.remote_host)
+
+    def _transfer_files(self):
+        if self.server_grp == 'ms':
+            self.logger.info(
+                f'By default, transferring files to/from {self.remote_dir}')
+
+        try:
+            self.logger.info(f'Currently in $HOME ({self.ftp.pwd()})')
+
+            changed_dir = False
+            if self.remote_dir != 'home':
+                self.logger.info(f'Changing directory to: {self.remote_dir}')
+                self.ftp.cwd(self.remote_dir)
+                changed_dir = True
+
+            self.logger.info('Switching to Binary mode.')
+            self.ftp.sendcmd('TYPE I')
+
+        except ftplib.all_errors:
+            if not changed_dir:
+                self.logger.error(
+                    f'{self.remote_dir} does not exist in the remote host!')
+
+            self.logger.info(dash_line)
+            self._close_session(self.ftp)
+            self.logger.info('FTP connection closed')
+            self.logger.info('Disconnected from server')
+            raise TerminateTheScript(self.logger)
+
+        # a file that fails doesn't stop the others, the failures are reported at the end
+        listed = True
+        try:
+            entries = self._bundle_small_files(self._expand_files(lambda: self.ftp), lambda: self.ftp)
+            upcoming = next(entries, None)
+            while upcoming is not None:
+                # the file after this one is known before this one is transferred (see _transfer_queued)
+                next_file, upcoming = upcoming, next(entries, None)
+                self.logger.info(dash_line)
+
+                # without a session (lost, see below) the file can't be compared, it's just transferred
+                if self.sync and self.ftp and self._skip_unchanged(self.ftp, next_file):
+                    self.results[next_file] = 0
+                    continue
+
+                self.logger.info(f'Starting {self.action} of {next_file}...')
+
+                if self.ftp:
+                    self.ftp.transfer_queued = self._transfer_queued(next_file, upcoming)
+                transferred, self.ftp = self._transfer_with_retry(self.ftp, next_file, show_progress=self.show_progress)
+                if self.ftp:
+                    # in case the transfer failed before its end, no PASV ahead of the commands that come next
+                    self.ftp.transfer_queued = False
+                self._record_result(self.results, next_file, transferred)
+                if transferred is not None:
+                    self.logger.info(f'File transfer successful, {self._transferred_message(next_file, transferred)}')
+                elif not self.ftp:
+                    # the next file's _transfer_with_retry opens a new session
+                    self.logger.warning('Session lost, a new one is opened for the next file')
+
+        except ftplib.all_errors as e:
+            self.logger.error(f'Unable to list the remote files ({e})')
+            listed = False
+
+        self.logger.info(dash_line)
+
+        if self._log_summary() or not listed:
+            self.logger.info(dash_line)
+            self._close_segment_sessions()
+            if self.ftp:
+                self._close_session(self.ftp)
+            self.logger.info('FTP connection closed')
+            self.logger.info('Disconnected from server')
+            raise TerminateTheScript(self.logger)
+
+
+    def _transfer_file(self, ftp, next_file, show_progress=True):
+        """
+        Class method to download or upload a single file over an already logged in session
+
+        Arguments:
+        ftp (ftplib.FTP object): Session logged in to the remote host
+        next_file (str): File to be transferred
+        show_progress (bool): Display the progress bar while transferring
+
+        Returns:
+        Bytes transferred, as counted while transferring them (those already there when resumed,
+        see self.resumed, are left out)
+        """
+
+        if posixpath.dirname(next_file):
+            # a file found in a (sub)directory, create its directory on the receiving side first
+            if self.action == 'upload':
+                self._make_remote_dirs(ftp, next_file)
+            else:
+                self._local_path(next_file).parent.mkdir(parents=True, exist_ok=True)
+
+        # --verify: the checksum is computed from the blocks as they go through, with the
+        # algorithm the remote host can hash with (sha256 if it can't)
+        hasher = None
+        if self.verify:
+            hasher = new_hasher(ftp.hash_method()[1] if ftp.hash_method() else 'sha256')
+
+        if isinstance(next_file, TarBundle):
+            return self._upload_bundle(ftp, next_file, show_progress, hasher)
+
+        if self.compress:
+            if self.action == 'upload':
+                return self._upload_compressed(ftp, next_file, show_progress, hasher)
+            if next_file.endswith(COMPRESS_SUFFIX[self.compress]):
+                return self._download_decompressed(ftp, next_file, show_progress, hasher)
+
+        progress = None
+        sidecar = {}
+
+        try:
+            if self.action == 'download':
+                # resuming and splitting into segments need the exact size, anything else makes do with the listing's
+                remote_size = ftp.size(next_file) if self.resume or self.segments > 1 else self._remote_size(ftp, next_file)
+
+                if self.segments > 1 and remote_size >= self.segments * MIN_SEGMENT_SIZE:
+                    return self._segmented_download(ftp, next_file, remote_size, show_progress, hasher)
+
+                offset = self._download_offset(next_file, remote_size) if self.resume else 0
+
+                if self.resume:
+                    sidecar = {'action': self.action, 'remote': self._remote_id(), 'remote_size': remote_size}
+                    self._write_sidecar(next_file, sidecar, offset)
+                    self.resumed[next_file] = offset
+
+                # nothing is written under the final name until the download is complete
+                partial_file = self._partial_path(next_file)
+                if hasher and offset:
+                    # the part downloaded before has to be in the checksum too
+                    hash_file(partial_file, hasher, offset)
+
+                with open(partial_file, 'r+b' if offset else 'wb', buffering=WRITE_BUFFER) as new_file:
+                    if offset:
+                        # drop anything after the last offset known to be written (e.g. preallocated space)
+                        new_file.truncate(offset)
+                        new_file.seek(offset)
+                    preallocate(new_file, remote_size)
+                    progress = TransferProgress(remote_size, enabled=show_progress, initial=offset)
+
+                    def write_block(block):
+                        new_file.write(block)
+                        if hasher:
+                            hasher.update(block)
+                        progress.update(len(block))
+
+                    ftp.retrbinary(cmd=f'RETR {next_file}', callback=write_block,
+                                   blocksize=self.blocksize, rest=offset or None)
+
+                    # in case the remote file turned out smaller than the preallocated size
+                    new_file.truncate()
+
+                if hasher:
+                    self._verify(ftp, next_file, hasher, partial_file)
+
+                os.replace(partial_file, self._local_path(next_file))
+
+                if self.sync:
+                    # so the next --sync sees the local copy as up to date
+                    self._set_local_mtime(ftp, next_file)
+            else:
+                local_stat = self._local_path(next_file).stat()
+                offset = self._upload_offset(ftp, next_file, local_stat) if self.resume else 0
+
+                if self.resume:
+                    sidecar = {'action': self.action, 'remote': self._remote_id(),
+                               'local_size': local_stat.st_size, 'local_mtime': local_stat.st_mtime}
+                    self._write_sidecar(next_file, sidecar, offset)
+                    self.resumed[next_file] = offset
+
+                if hasher and offset:
+                    # the part uploaded before has to be in the checksum too
+                    hash_file(self._local_path(next_file), hasher, offset)
+
+                with open(self._local_path(next_file), 'rb') as new_file:
+                    progress = TransferProgress(local_stat.st_size, enabled=show_progress, initial=offset)
+
+                    if offset:
+                        # continue the upload by appending the rest of the file to the partial remote copy
+                        new_file.seek(offset)
+
+                    if offset and offset == local_stat.st_size:
+                        self.logger.info(f'{next_file} was already completely uploaded')
+                    else:
+                        # checksumming the blocks on their way means going through Python instead of sendfile
+                        ftp.storfile(f'{"APPE" if offset else "STOR"} {next_file}',
+                                     HashingReader(new_file, hasher) if hasher else new_file,
+                                     blocksize=self.blocksize, callback=progress.update)
+
+                if hasher:
+                    self._verify(ftp, next_file, hasher)
+
+        except ftplib.all_errors as e:
+            if progress:
+                progress.finish()
+            if sidecar and not isinstance(e, ChecksumMismatchError):
+                # record how far we got so the next --resume can pick it up from there
+                self._write_sidecar(next_file, sidecar, progress.done if progress else 0)
+            raise
+
+        progress.finish()
+
+        if sidecar:
+            with contextlib.suppress(FileNotFoundError):
+                self._local_path(f'{next_file}{RESUME_SUFFIX}').unlink()
+
+        # the transfer ended with a 226 reply, so no need for another SIZE round trip to know how much went through
+        return progress.done - progress.initial
+
+
+    def _upload_compressed(self, ftp, next_file, show_progress=True, hasher=None):
+        """
+        Class method to upload a file compressed on the fly as <file>.gz (or .zst), then send
+        the post-command (if any) that decompresses it on the remote host
+
+        Returns:
+        Size (in bytes) of the compressed remote file
+        """
+
+        remote_file = f'{next_file}{COMPRESS_SUFFIX[self.compress]}'
+        local_file = self._local_path(next_file)
+
+        with open(local_file, 'rb') as new_file:
+            progress = TransferProgress(local_file.stat().st_size, enabled=show_progress)
+            reader = CompressingReader(new_file, self.compress, callback=progress.update)
+            try:
+                ftp.storbinary(f'STOR {remote_file}', HashingReader(reader, hasher) if hasher else reader,
+                               blocksize=self.blocksize)
+            finally:
+                progress.finish()
+
+        if hasher:
+            self._verify(ftp, remote_file, hasher)
+
+        transferred = reader.size
+        self.logger.info(f'{next_file} ({progress.total} bytes) uploaded as {remote_file} ({transferred} bytes)')
+
+        if self.compress_post_command:
+            reply = ftp.sendcmd(self.compress_post_command.format(file=remote_file))
+            self.logger.info(f'Post-command reply: {reply}')
+
+        return transferred
+
+
+    def _upload_bundle(self, ftp, bundle, show_progress=True, hasher=None):
+        """
+        Class method to upload small files as one tar stream (one STOR instead of one per file),
+        then send the post-command that unpacks it on the remote host
+
+        Returns:
+        Size (in bytes) of the remote tar file
+        """
+
+        progress = TransferProgress(bundle.size, enabled=show_progress)
+        reader = TarReader(((self._local_path(name), name) for name, size in bundle.files), callback=progress.update)
+        try:
+            ftp.storbinary(f'STOR {bundle}', HashingReader(reader, hasher) if hasher else reader,
+                           blocksize=self.blocksize)
+        finally:
+            progress.finish()
+
+        if hasher:
+            self._verify(ftp, bundle, hasher)
+
+        self.logger.info(f'{len(bundle.files)} files ({bundle.size} bytes) uploaded as {bundle} ({reader.size} bytes)')
+
+        reply = ftp.sendcmd(self.bundle_post_command.format(file=bundle))
+        self.logger.info(f'Post-command reply: {reply}')
+
+        return reader.size
+
+
+    def _download_decompressed(self, ftp, next_file, show_progress=True, hasher=None):
+        """
+        Class method to download a .gz (or .zst) file, decompressing it on the fly
+        to the local file without the suffix
+
+        Returns:
+        Size (in bytes) of the compressed remote file
+        """
+
+        local_name = next_file[:-len(COMPRESS_SUFFIX[self.compress])]
+        partial_file = self._partial_path(local_name)
+        remote_size = self._remote_size(ftp, next_file)
+        # zstandard is only installed (and loaded) if it's used
+        decompress_errors = (zlib.error, zstandard.ZstdError) if self.compress == 'zstd' else (zlib.error,)
+
+        try:
+            with open(partial_file, 'wb', buffering=WRITE_BUFFER) as new_file:
+                progress = TransferProgress(remote_size, enabled=show_progress)
+                decompressor = StreamDecompressor(self.compress)
+
+                def write_block(block):
+                    new_file.write(decompressor.decompress(block))
+                    if hasher:
+                        # the checksum is the one of the compressed remote file
+                        hasher.update(block)
+                    progress.update(len(block))
+
+                try:
+                    ftp.retrbinary(cmd=f'RETR {next_file}', callback=write_block, blocksize=self.blocksize)
+                except decompress_errors:
+                    # retrbinary stopped mid-transfer, the reply that ends it is still to be read (or the
+                    # next command gets it instead of its own)
+                    with contextlib.suppress(*ftplib.all_errors):
+                        ftp.voidresp()
+                    raise
+                finally:
+                    progress.finish()
+                new_file.write(decompressor.flush())
+
+                if not decompressor.eof:
+                    raise ftplib.error_proto(f'{next_file} is truncated, not a complete {self.compress} file')
+
+            if hasher:
+                self._verify(ftp, next_file, hasher, partial_file)
+
+        except (*ftplib.all_errors, *decompress_errors) as e:
+            with contextlib.suppress(FileNotFoundError):
+                partial_file.unlink()
+            if isinstance(e, decompress_errors):
+                raise ftplib.error_proto(f'{next_file} is not a valid {self.compress} file ({e})')
+            raise
+
+        os.replace(partial_file, self._local_path(local_name))
+        self.logger.info(f'{next_file} ({progress.done} bytes) decompressed to {local_name} ({self._local_path(local_name).stat().st_size} bytes)')
+
+        return progress.done
+
+
+    def _segmented_download(self, ftp, next_file, remote_size, show_progress=True, hasher=None):
+        """
+        Class method to download one big file as byte ranges, each over its own gateway session
+        (the current session plus self.segments - 1 extra ones) into a preallocated local file
+
+        Arguments:
+        ftp (ftplib.FTP object): Session logged in to the remote host, downloads the first range
+        next_file (str): File to be downloaded
+        remote_size (int): Size (in bytes) of the remote file
+        show_progress (bool): Display the progress bar while transferring
+        hasher (hashlib object): --verify checksum, computed from the file once it's stitched together
+
+        Returns:
+        Size (in bytes) of the downloaded file
+        """
+
+        # a session kept from the previous file may have died since (e.g. idle timeout), it's opened again
+        for session in [session for session in self.segment_sessions if not session_alive(session)]:
+            self._drop_segment_session(session)
+
+        if len(self.segment_sessions) < self.segments - 1:
+            self.logger.info(
+                f'Opening {self.segments - 1 - len(self.segment_sessions)} more session(s) for the segmented download...')
+            self.logger.info('Please approve the push notification(s) (sign-in request) in your "VIP Access" mobile app...')
+            while len(self.segment_sessions) < self.segments - 1:
+                self.segment_sessions.append(self._open_session())
+
+        sessions = [ftp] + self.segment_sessions
+        segment_size = -(-remote_size // len(sessions))
+        ranges = [(start, min(start + segment_size, remote_size)) for start in range(0, remote_size, segment_size)]
+
+        self.logger.info(f'Downloading {next_file} in {len(ranges)} segments of up to {segment_size} bytes')
+
+        # preallocate the local file so every segment can write at its own offset
+        partial_file = self._partial_path(next_file)
+        with open(partial_file, 'wb') as new_file:
+            new_file.truncate(remote_size)
+            preallocate(new_file, remote_size)
+
+        progress = TransferProgress(remote_size, enabled=show_progress)
+        errors = []
+        workers = [threading.Thread(target=self._download_segment, args=(session, next_file, start, end, progress, errors))
+                   for session, (start, end) in zip(sessions, ranges)]
+
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        progress.finish()
+
+        for session, error in errors:
+            # the reply to its RETR may be left unread, so the session is out of step with the server
+            if session is not ftp:
+                self._drop_segment_session(session)
+            elif not isinstance(error, ftplib.error_perm):
+                # closed, so the retry (see _transfer_with_retry) opens a new one
+                ftp.close()
+
+        if errors:
+            raise errors[0][1]
+
+        # all ranges are in place, make sure the stitched file is complete
+        local_size = partial_file.stat().st_size
+        if local_size != remote_size or progress.done != remote_size:
+            raise ftplib.error_temp(
+                f'451 Segmented download of {next_file} incomplete ({progress.done} of {remote_size} bytes)')
+
+        if hasher:
+            # the segments arrive out of order, so this one is read back from the disk
+            hash_file(partial_file, hasher)
+            self._verify(ftp, next_file, hasher, partial_file)
+
+        os.replace(partial_file, self._local_path(next_file))
+        return local_size
+
+
+    def _download_segment(self, ftp, next_file, start, end, progress, errors):
+        """
+        Class method (thread target) to download the byte range [start, end) of a file with REST <start>
+        and write it at the same offset of the local file
+
+        Arguments:
+        ftp (ftplib.FTP object): Session logged in to the remote host
+        next_file (str): File to be downloaded
+        start (int): Offset of the first byte of the range
+        end (int): Offset of the byte after the last byte of the range
+        progress (TransferProgress object): Shared progress bar
+        errors (list): Collects the session and the ftplib error of a failed segment, so the calling thread can raise it
+        """
+
+        remaining = end - start
+
+        try:
+            with open(self._partial_path(next_file), 'r+b', buffering=WRITE_BUFFER) as new_file:
+                new_file.seek(start)
+
+                with ftp.transfercmd(f'RETR {next_file}', rest=start) as conn:
+                    while remaining:
+                        block = conn.recv(min(self.blocksize, remaining))
+                        if not block:
+                            break
+                        # paced like retrbinary, the segments share the limit of the gateway
+                        if ftp.rate_limiter:
+                            ftp.rate_limiter.consume(len(block))
+                        new_file.write(block)
+                        remaining -= len(block)
+                        progress.update(len(block))
+
+            # closing the data connection before the end of the file makes the server answer 426 (or 451),
+            # which is expected for every segment but the last one
+            with contextlib.suppress(ftplib.error_temp):
+                ftp.voidresp()
+
+            if remaining:
+                raise ftplib.error_temp(f'426 Segment {start}-{end} of {next_file} ended {remaining} bytes early')
+
+        except ftplib.all_errors as e:
+            errors.append((ftp, e))
+
+
+    def _drop_segment_session(self, session):
+        """Class method to close one of the extra sessions of the segmented downloads (see _close_segment_sessions)"""
+
+        self.segment_sessions.remove(session)
+        if self.pool:
+            self.pool.discard(session)
+        else:
+            session.close()
+
+
+    def _close_segment_sessions(self):
+        for session in self.segment_sessions:
+            if self.pool:
+                self.pool.release(session)
+                continue
+            with contextlib.suppress(*ftplib.all_errors):
+                session.quit()
+            session.close()
+        self.segment_sessions = []
+
+
+    def _transfer_with_retry(self, ftp, next_file, show_progress=True, prefix=''):
+        """
+        Class method to transfer a file (see _transfer_file), trying again up to self.retries times after
+        a transient error (4xx reply, lost connection) or a checksum mismatch (--verify). The retries wait
+        longer and longer (see _backoff), and if the control connection is gone a new session is opened
+        first (from the daemon's or manifest's pool of authenticated gateway sessions, if any).
+        A permanent error (5xx, e.g. 550 file not found) is not retried.
+
+        Arguments:
+        ftp (ftplib.FTP object): Session logged in to the remote host
+        next_file (str): File to be transferred
+        show_progress (bool): Display the progress bar while transferring
+        prefix (str): Prefix of the log messages (e.g. [session 1])
+
+        Returns:
+        Tuple of the bytes transferred (None if it failed, see _transfer_file) and
+        the session to carry on with (None if it was lost and couldn't be opened again)
+        """
+
+        start = time.perf_counter()
+        attempts = self.retries + 1
+        for attempt in range(1, attempts + 1):
+            try:
+                if not ftp:
+                    self.logger.info(f'{prefix} Reconnecting to {self.remote_user}@{self.remote_host}...'.lstrip())
+                    if not self.pool:
+                        self.logger.info(
+                            f'{prefix} Please approve the push notification (sign-in request) in your "VIP Access" mobile app...'.lstrip())
+                    ftp = self._open_session()
+
+                transferred = self._transfer_file(ftp, next_file, show_progress)
+                details = {'resumed_at': self.resumed[next_file]} if self.resumed.get(next_file) else {}
+                METRICS.record('transfer', time.perf_counter() - start, dict(self._metric_labels(), status='ok'),
+                               nbytes=transferred, file=next_file, attempts=attempt, **details)
+                return transferred, ftp
+
+            except ChecksumMismatchError as e:
+                # the session is fine, transfer it again right away
+                error = e
+                delay = 0
+
+            except ftplib.error_perm as e:
+                error = e
+                break
+
+            except ftplib.all_errors as e:
+                error = e
+                delay = self._backoff(attempt)
+                if ftp and not session_alive(ftp):
+                    self._close_session(ftp, alive=False)
+                    ftp = None
+
+            if attempt < attempts:
+                self.logger.warning(f'{prefix} {next_file}: {error}, trying again in {delay:.1f}s '
+                                    f'(attempt {attempt + 1} of {attempts})'.lstrip())
+                time.sleep(delay)
+
+        self.logger.error(f'{prefix} {next_file}: {self.action} failed ({error})'.lstrip())
+        METRICS.record('transfer', time.perf_counter() - start, dict(self._metric_labels(), status='failed'),
+                       file=next_file, attempts=attempt, error=str(error))
+        if self.action == 'download':
+            self._discard_partial_download(next_file)
+
+        return None, ftp
+
+
+    def _transfer_queued(self, next_file, upcoming):
+        """
+        Class method that tells if the transfer of a small file is followed right away by another one, with no other
+        command in between, so the session can ask for the next data connection early (see GatewayFTP.transfer_queued)
+
+        Arguments:
+        next_file (str): File about to be transferred
+        upcoming (str): File transferred after it, None if it's the last one
+
+        Returns:
+        True if the next PASV can be sent ahead
+        """
+
+        # these all send commands of their own before or after the transfers (SIZE, HASH, MDTM, SITE, REST...)
+        if upcoming is None or self.sync or self.verify or self.resume or self.compress or self.segments > 1:
+            return False
+        if isinstance(next_file, TarBundle) or isinstance(upcoming, TarBundle):
+            return False
+
+        if self.action == 'upload':
+            directory = posixpath.dirname(upcoming)
+            if directory and directory not in self.remote_dirs:
+                # its directory is created first (MKD)
+                return False
+            try:
+                size = self._local_path(next_file).stat().st_size
+            except OSError:
+                return False
+            return size <= PIPELINE_FILE_SIZE
+
+        # without a listing, the size of a file to be downloaded is asked for first (SIZE)
+        with self.listing_lock:
+            facts = [(self.remote_listing.get(directory) or {}).get(name)
+                     for directory, name in (posixpath.split(next_file), posixpath.split(upcoming))]
+        return (all(entry and entry['type'] == 'file' for entry in facts)
+                and facts[0]['size'] <= PIPELINE_FILE_SIZE)
+
+
+    def _backoff(self, attempt):
+        """
+        Class method that returns how long (in seconds) to wait before the next attempt: exponential
+        (self.retry_backoff, twice that, four times...) up to RETRY_BACKOFF_MAX, with a random part
+        (jitter) so sessions that failed at the same time don't all come back at the same time
+        """
+
+        delay = min(RETRY_BACKOFF_MAX, self.retry_backoff * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
+
+    def _verify(self, ftp, remote_file, hasher, partial_file=None):
+        """
+        Class method (--verify) to compare the checksum computed during the transfer with the one computed by the
+        remote host (HASH, XSHA256, XSHA1, XMD5 or XCRC). If the remote host can't hash files, a download is compared
+        with the remote <file>.sha256 (if any) and an upload leaves one next to the uploaded file.
+        On a mismatch, the transferred copy is deleted so the next attempt starts from scratch.
+
+        Arguments:
+        ftp (ftplib.FTP object): Session logged in to the remote host
+        remote_file (str): Transferred remote file
+        hasher (hashlib object): Checksum of the transferred data
+        partial_file (Path object): Local copy of a download, before it's renamed
+        """
+
+        checksum = hasher.hexdigest()
+
+        try:
+            if ftp.hash_method():
+                remote_checksum = ftp.remote_hash(remote_file)
+            elif self.action == 'upload':
+                checksum_file = io.BytesIO(f'{checksum}  {posixpath.basename(remote_file)}\n'.encode())
+                ftp.storbinary(f'STOR {remote_file}{CHECKSUM_SUFFIX}', checksum_file)
+                self.logger.info(f'{remote_file}: no remote checksum command, left {hasher.name} {checksum} '
+                                 f'in {remote_file}{CHECKSUM_SUFFIX}')
+                return
+            else:
+                checksum_file = io.BytesIO()
+                ftp.retrbinary(f'RETR {remote_file}{CHECKSUM_SUFFIX}', checksum_file.write)
+                remote_checksum = checksum_file.getvalue().decode(errors='replace').split()[0].lower()
+
+        except (ftplib.error_perm, IndexError) as e:
+            self.logger.warning(f'{remote_file}: no remote checksum to compare with ({e}), not verified')
+            return
+
+        if remote_checksum == checksum:
+            self.logger.info(f'{remote_file}: {hasher.name} checksum verified ({checksum})')
+            return
+
+        if partial_file:
+            partial_file.unlink()
+        else:
+            with contextlib.suppress(ftplib.error_perm):
+                ftp.delete(remote_file)
+
+        # an interrupted transfer of it (if any) isn't worth resuming either
+        with contextlib.suppress(FileNotFoundError):
+            self._local_path(f'{remote_file}{RESUME_SUFFIX}').unlink()
+
+        raise ChecksumMismatchError(
+            f'{remote_file}: {hasher.name} checksum mismatch (local {checksum}, remote {remote_checksum})')
+
+
+    def _local_path(self, next_file):
+        """Class method that returns the local Path object of a file to be transferred"""
+
+        return self.local_dir / next_file
+
+
+    def _partial_path(self, next_file):
+        """Class method that returns the temporary local Path object a file is downloaded to"""
+
+        return self.local_dir / f'{next_file}{PARTIAL_SUFFIX}'
+
+
+    def _remote_id(self):
+        """Class method that returns the remote user, host and directory a resumable transfer belongs to"""
+
+        return f'{self.remote_user}@{self.remote_host}:{self.remote_dir}'
+
+
+    def _read_sidecar(self, next_file):
+        """
+        Class method to read the resume sidecar file of an interrupted transfer
+
+        Returns:
+        A dictionary of the recorded details, empty if there's no (valid) sidecar file
+        """
+
+        with contextlib.suppress(OSError, ValueError):
+            with open(self._local_path(f'{next_file}{RESUME_SUFFIX}')) as f:
+                return json.load(f)
+        return {}
+
+
+    def _write_sidecar(self, next_file, sidecar, offset):
+        with open(self._local_path(f'{next_file}{RESUME_SUFFIX}'), 'w') as f:
+            json.dump({**sidecar, 'offset': offset}, f)
+
+
+    def _download_offset(self, next_file, remote_size):
+        """
+        Class method to determine where an interrupted download can be resumed from.
+        The partial local file is only trusted if its sidecar file matches the remote file.
+
+        Returns:
+        Offset (in bytes) to pass to REST, 0 to start over
+        """
+
+        partial_file = self._partial_path(next_file)
+        sidecar = self._read_sidecar(next_file)
+
+        if not sidecar or not partial_file.exists():
+            return 0
+
+        if (sidecar.get('action') != 'download' or sidecar.get('remote') != self._remote_id()
+                or sidecar.get('remote_size') != remote_size):
+            self.logger.warning(f'{next_file} changed since the interrupted download, starting over')
+            return 0
+
+        # the partial file is preallocated, so its size says nothing; the sidecar has the offset
+        # written so far (if the script was killed, the offset the interrupted download started from)
+        offset = min(partial_file.stat().st_size, sidecar.get('offset', 0))
+
+        self.logger.info(f'Resuming download of {next_file} at byte {offset} of {remote_size}')
+        return offset
+
+
+    def _upload_offset(self, ftp, next_file, local_stat):
+        """
+        Class method to determine where an interrupted upload can be resumed from.
+        The partial remote file is only trusted if the local file is unchanged since the interrupted upload.
+
+        Returns:
+        Offset (in bytes) to continue the upload from (with APPE), 0 to start over
+        """
+
+        sidecar = self._read_sidecar(next_file)
+
+        if not sidecar:
+            return 0
+
+        if (sidecar.get('action') != 'upload' or sidecar.get('remote') != self._remote_id()
+                or sidecar.get('local_size') != local_stat.st_size or sidecar.get('local_mtime') != local_stat.st_mtime):
+            self.logger.warning(f'{next_file} changed since the interrupted upload, starting over')
+            return 0
+
+        try:
+            offset = ftp.size(next_file)
+        except ftplib.error_perm:
+            # no partial copy on the remote host
+            return 0
+
+        if offset > local_stat.st_size:
+            self.logger.warning(f'Remote copy of {next_file} is bigger than the local file, starting over')
+            return 0
+
+        self.logger.info(f'Resuming upload of {next_file} at byte {offset} of {local_stat.st_size}')
+        return offset
+
+
+    def _discard_partial_download(self, next_file):
+        """
+        Class method to delete the (temporary) local copy of a failed download,
+        unless it's kept (with its sidecar file) for a later --resume
+        """
+
+        local_file = self._partial_path(next_file)
+        if not local_file.exists():
+            return
+
+        if self.resume and self._local_path(f'{next_file}{RESUME_SUFFIX}').exists():
+            self.logger.info(
+                f'Download failed. Keeping the partial copy ({local_file}), run again with --resume to continue')
+        else:
+            self.logger.info('Download failed. Deleting local copy...')
+            local_file.unlink()
+
+
+    def _open_session(self):
+        """
+        Class method to open one more gateway session, login to the remote host,
+        change to the remote directory and switch to Binary mode
+
+        Returns:
+        A ftplib.FTP object ready for file transfer
+        """
+
+        if self.pool:
+            ftp = self.pool.get()
+        else:
+            ftp = GatewayFTP(host=self.gateway, socket_buffer=self.socket_buffer, logger=self.logger)
+
+        try:
+            if not self.pool:
+                with METRICS.timed('login_gateway', {'gateway': self.gateway}):
+                    ftp.login(user=self.gate_user, passwd=self.gate_pwd)
+            ftp = self._login_remote(ftp)
+
+            if self.remote_dir != 'home':
+                ftp.cwd(self.remote_dir)
+
+            ftp.sendcmd('TYPE I')
+        except ftplib.all_errors:
+            self._close_session(ftp)
+            raise
+
+        return ftp
+
+
+    def _login_remote(self, ftp):
+        """
+        Class method to login to the remote host (USER user@host, PASS) over a session logged in to the Unix gate.
+        If the session was recycled from another transfer (see GatewaySessionPool.release) and the login fails,
+        a fresh session from the pool tries again; if that one succeeds, the Unix gate can't switch hosts after
+        all, so the pool stops recycling sessions
+
+        Arguments:
+        ftp (GatewayFTP object): Session logged in to the Unix gate
+
+        Returns:
+        The session logged in to the remote host, which is a fresh one if the recycled one failed
+        """
+
+        ftp.rate_limiter = self.rate_limiter
+
+        try:
+            with METRICS.timed('login_remote_host', {'gateway': self.gateway, 'host': self.remote_host}):
+                ftp.sendcmd(f'USER {self.remote_user}@{self.remote_host}')
+                ftp.sendcmd(f'PASS {self.remote_pwd}')
+            return ftp
+        except ftplib.all_errors:
+            if not ftp.recycled:
+                raise
+
+        self.logger.debug(f'Recycled session unable to login to {self.remote_host}, trying a fresh one')
+        fresh = self.pool.get(recycled=False)
+        try:
+            fresh = self._login_remote(fresh)
+        except ftplib.all_errors:
+            # most likely the remote host login itself then, the recycled session is left to the caller
+            self.pool.release(fresh)
+            raise
+
+        self.pool.stop_recycling()
+        self.pool.discard(ftp)
+        return fresh
+
+
+    def _close_session(self, ftp, alive=True):
+        """
+        Class method to be done with a session: given back to the pool if it came from one (see
+        GatewaySessionPool.release), closed otherwise
+
+        Arguments:
+        ftp (GatewayFTP object): Session to be done with
+        alive (bool): False if the connection is known to be lost, so it can't be given back
+        """
+
+        if ftp is self.ftp:
+            # given back, it may already be another job's (see discard_sessions)
+            self.ftp = None
+
+        if not self.pool:
+            ftp.close()
+        elif alive:
+            self.pool.release(ftp)
+        else:
+            self.pool.discard(ftp)
+
+
+    def discard_sessions(self):
+        """
+        Class method to discard the pool sessions still held when the transfer ended with an unexpected
+        error (daemon jobs), rather than giving them back in whatever state they were left
+        """
+
+        for session in list(self.segment_sessions):
+            self._drop_segment_session(session)
+        if self.ftp:
+            self._close_session(self.ftp, alive=False)
+
+
+    def _transfer_worker(self, session_no, work_queue, results):
+        """
+        Class method (thread target) that opens its own session then keeps on
+        taking the next file from the work queue until it gets the end of the queue (None)
+
+        Arguments:
+        session_no (int): session number, used as prefix in the log
+        work_queue (queue.Queue object): files waiting to be transferred
+        results (dict): file as key, transferred bytes (or None if failed) as value
+        """
+
+        prefix = f'[session {session_no}]'
+
+        try:
+            ftp = self._open_session()
+        except ftplib.all_errors as e:
+            self.logger.error(f'{prefix} Unable to login to {self.remote_user}@{self.remote_host} ({e})')
+            if session_no == 1:
+                # the other sessions are still waiting for their files, remote patterns/directories are queued as is
+                self._feed_queue(lambda: None, work_queue)
+            return
+
+        self.logger.info(f'{prefix} Logged in: {self.remote_user}@{self.remote_host}')
+
+        if session_no == 1:
+            # the first session walks the file list into the queue while the other ones already transfer
+            self._feed_queue(lambda: ftp, work_queue)
+
+        while True:
+            next_file = work_queue.get()
+            if next_file is None:
+                break
+
+            if self.sync and ftp and self._skip_unchanged(ftp, next_file, prefix):
+                results[next_file] = 0
+                continue
+
+            self.logger.info(f'{prefix} Starting {self.action} of {next_file}...')
+            transferred, ftp = self._transfer_with_retry(ftp, next_file, show_progress=False, prefix=prefix)
+            self._record_result(results, next_file, transferred)
+
+            if transferred is not None:
+                self.logger.info(
+                    f'{prefix} {next_file}: file transfer successful, {self._transferred_message(next_file, transferred)}')
+            elif not ftp:
+                # the next file's _transfer_with_retry opens a new session
+                self.logger.warning(f'{prefix} Session lost, a new one is opened for the next file')
+
+        if ftp and self.pool:
+            self.pool.release(ftp)
+        elif ftp:
+            with contextlib.suppress(*ftplib.all_errors):
+                ftp.quit()
+            ftp.close()
+
+        self.logger.info(f'{prefix} FTP connection closed')
+
+
+    def _parallel_transfer(self):
+        """
+        Class method to open a pool of gateway sessions and spread the file list
+        across them through a work queue
+        """
+
+        if any(self._expandable(entry) for entry in self.files):
+            sessions = self.parallel
+        else:
+            sessions = min(self.parallel, len(self.files))
+        work_queue = queue.Queue()
+        results = self.results
+
+        self.logger.info(
+            f'Opening {sessions} parallel sessions through the {self.gate_location.title()} Gate ({self.gateway})...')
+        self.logger.info(
+            f'Please approve the {sessions} push notifications (sign-in requests) in your "VIP Access" mobile app...')
+        self.logger.info(f'Transferring files to/from {self.remote_dir}')
+
+        workers = [threading.Thread(target=self._transfer_worker, args=(n, work_queue, results))
+                   for n in range(1, sessions + 1)]
+
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.logger.info(dash_line)
+
+        if not results:
+            raise GatewayConnectionError(self.logger, self.gateway, self.gate_location)
+
+        if self._log_summary():
+            self.logger.info(dash_line)
+            raise TerminateTheScript(self.logger)
+
+        self.logger.info(dash_line)
+
+
+    def _transferred_message(self, next_file, transferred):
+        """Class method that returns how many bytes of a file were transferred, and where it was resumed (if it was)"""
+
+        offset = self.resumed.get(next_file)
+        return f'transferred {transferred} bytes' + (f', resumed at byte {offset}' if offset else '')
+
+
+    def _log_summary(self):
+        """
+        Class method to log how many of the files were transferred, and which ones failed
+
+        Returns:
+        List of the files that failed (or were never picked up because every session was lost)
+        """
+
+        failed = [next_file for next_file in self.queued if self.results.get(next_file) is None]
+        total = sum(size for size in self.results.values() if size)
+        self.logger.info(
+            f'{len(self.queued) - len(failed)} of {len(self.queued)} file(s) transferred, {total} bytes in total')
+        self._log_sync_summary()
+
+        resumed = [offset for next_file, offset in self.resumed.items() if offset and self.results.get(next_file) is not None]
+        if resumed:
+            self.logger.info(f'{len(resumed)} file(s) resumed, {format_size(sum(resumed))} already transferred before')
+
+        if failed:
+            self.logger.error(f'Failed to {self.action}: {", ".join(failed)}')
+
+        return failed
+
+
+    def _skip_unchanged(self, ftp, next_file, prefix=''):
+        """
+        Class method (--sync) that compares the local file's size and modification time with the remote file's.
+        An upload is skipped if the remote copy has the same size and is at least as recent as the local file,
+        and a download the other way around.
+
+        Arguments:
+        ftp (ftplib.FTP object): Session logged in to the remote host
+        next_file (str): File to be transferred
+        prefix (str): Prefix of the log messages (e.g. [session 1])
+
+        Returns:
+        True if the file is already up to date and was skipped
+        """
+
+        if isinstance(next_file, TarBundle):
+            # its files were already compared when they were bundled
+            return False
+
+        local_file = self._local_path(next_file)
+        try:
+            remote = self._remote_facts(ftp, next_file)
+        except ftplib.all_errors:
+            # e.g. the session is gone, the transfer itself will deal with it
+            return False
+
+        if not remote or not local_file.exists():
+            return False
+
+        local_stat = local_file.stat()
+        if local_stat.st_size != remote['size']:
+            return False
+
+        if self.action == 'upload':
+            up_to_date = remote['modify'] >= int(local_stat.st_mtime)
+        else:
+            up_to_date = int(local_stat.st_mtime) >= remote['modify']
+
+        if up_to_date:
+            self.skipped[next_file] = remote['size']
+            self.logger.info(f'{prefix} {next_file} is up to date ({remote["size"]} bytes), skipped'.lstrip())
+        return up_to_date
+
+
+    def _remote_facts(self, ftp, next_file):
+        """
+        Class method that returns the size and modification time of a remote file, from the cached
+        MLSD listing of its directory (or from SIZE and MDTM if the server doesn't support MLSD)
+
+        Returns:
+        A dictionary of size (bytes) and modify (seconds since the epoch, UTC), None if there's no such remote file
+        """
+
+        directory, name = posixpath.split(next_file)
+        listing = self._remote_listing(ftp, directory)
+
+        if listing is not None:
+            facts = listing.get(name)
+            return facts if facts and facts['type'] == 'file' else None
+
+        try:
+            size = ftp.size(next_file)
+            modify = parse_ftp_time(ftp.sendcmd(f'MDTM {next_file}')[4:])
+        except ftplib.error_perm:
+            return None
+
+        return {'size': size, 'modify': modify} if size is not None else None
+
+
+    def _remote_size(self, ftp, next_file):
+        """
+        Class method that returns the size of a remote file from the listing of its directory if it was already
+        listed (while expanding the --file entries), else from SIZE; one round trip less per file
+        """
+
+        directory, name = posixpath.split(next_file)
+        with self.listing_lock:
+            facts = (self.remote_listing.get(directory) or {}).get(name)
+
+        if facts and facts['type'] == 'file':
+            return facts['size']
+        return ftp.size(next_file)
+
+
+    def _remote_listing(self, ftp, directory):
+        """Class method that returns the (cached) listing of a remote directory, see _list_remote_dir"""
+
+        with self.listing_lock:
+            if directory not in self.remote_listing:
+                self.remote_listing[directory] = self._list_remote_dir(ftp, directory)
+            return self.remote_listing[directory]
+
+
+    def _list_remote_dir(self, ftp, directory):
+        """
+        Class method to list a remote directory (one MLSD round trip) with the type, size and modification time of its entries
+
+        Returns:
+        A dictionary of name as key, dictionary of type (file or dir), size and modify as value
+        (subdirectories only have the type); None if the server doesn't support MLSD
+        """
+
+        listing = {}
+        try:
+            for name, facts in ftp.mlsd(directory):
+                if facts.get('type', 'file') == 'file' and 'size' in facts and 'modify' in facts:
+                    listing[name] = {'type': 'file', 'size': int(facts['size']), 'modify': parse_ftp_time(facts['modify'])}
+                elif facts.get('type') == 'dir':
+                    listing[name] = {'type': 'dir'}
+
+        except ftplib.error_perm as e:
+            if str(e)[:3] == '550':
+                # the remote directory doesn't exist (yet), so neither do the files
+                return listing
+            self.logger.warning(f'MLSD not supported ({e}), falling back to NLST, SIZE and MDTM')
+            return None
+
+        return listing
+
+
+    def _make_remote_dirs(self, ftp, next_file):
+        """Class method to create (MKD) the remote directory of a file to be uploaded, and its parents, once per run"""
+
+        parts = posixpath.dirname(next_file).split('/')
+
+        with self.listing_lock:
+            for n in range(1, len(parts) + 1):
+                directory = '/'.join(parts[:n])
+                if not directory or directory in self.remote_dirs:
+                    continue
+                with contextlib.suppress(ftplib.error_perm):
+                    # 550 if it already exists, anything else will make the upload itself fail
+                    ftp.mkd(directory)
+                self.remote_dirs.add(directory)
+
+
+    def _expandable(self, entry):
+        """Class method that tells if a --file entry may stand for more than one file (glob pattern or directory)"""
+
+        if glob.has_magic(entry):
+            return True
+        if self.action == 'upload':
+            return self._local_path(entry).is_dir()
+        return entry.endswith('/')
+
+
+    def _expand_files(self, session):
+        """
+        Class method (generator) that expands the --file entries into the files to be transferred.
+        Directories are walked recursively and glob patterns (e.g. extract_2026*.dat) are matched,
+        locally for uploads and against one MLSD listing per remote directory for downloads.
+        Each file is yielded as soon as it is found, so the transfer starts before the walk is over.
+
+        Arguments:
+        session (function): Returns the session to list the remote directories with, i.e. the current one
+                            after a reconnect (None to queue remote entries as is)
+
+        Yields:
+        The next file to be transferred, relative to the local and the remote directory
+        """
+
+        seen = set()
+        for entry in self.files:
+            if self.action == 'upload':
+                files = self._walk_local(entry)
+            else:
+                files = self._walk_remote(session, entry)
+
+            for next_file in files:
+                if next_file not in seen:
+                    seen.add(next_file)
+                    self.queued.append(next_file)
+                    yield next_file
+
+
+    def _bundle_small_files(self, files, session):
+        """
+        Class method (generator) that packs the small files (up to BUNDLE_FILE_SIZE bytes) to be uploaded into
+        tar bundles (see TarBundle) of up to BUNDLE_MAX_FILES files, if the remote host can unpack them (--bundle).
+        The other files are yielded as they come. With --sync, the small files are compared before being bundled.
+
+        Arguments:
+        files (iterator): Files to be transferred (see _expand_files)
+        session (function): Returns the session to compare the files with (--sync)
+
+        Yields:
+        The next file, or TarBundle object, to be transferred
+        """
+
+        if not self.bundle_post_command or self.action != 'upload':
+            yield from files
+            return
+
+        bundled = []
+        for next_file in files:
+            try:
+                size = self._local_path(next_file).stat().st_size
+            except OSError:
+                # e.g. no such file, it fails on its own
+                size = None
+
+            if size is None or size > BUNDLE_FILE_SIZE or (self.sync and not session()):
+                yield next_file
+                continue
+
+            if self.sync and self._skip_unchanged(session(), next_file):
+                self.results[next_file] = 0
+                continue
+
+            bundled.append((next_file, size))
+            if len(bundled) == BUNDLE_MAX_FILES:
+                yield TarBundle(bundled)
+                bundled = []
+
+        if len(bundled) > 1:
+            yield TarBundle(bundled)
+        elif bundled:
+            # a bundle of one file would only cost the post-command on top
+            yield bundled[0][0]
+
+
+    def _record_result(self, results, next_file, transferred):
+        """Class method to record the bytes transferred (None if failed) of a file, or of every file of a bundle"""
+
+        if isinstance(next_file, TarBundle):
+            for name, size in next_file.files:
+                results[name] = size if transferred is not None else None
+        else:
+            results[next_file] = transferred
+
+
+    def _walk_local(self, entry):
+        """Class method (generator) that yields the local file(s) a --file entry stands for"""
+
+        if self._local_path(entry).exists() or not glob.has_magic(entry):
+            matches = [entry]
+        else:
+            # nothing matching is left as is, the upload of it fails like any missing file
+            pattern = os.path.join(glob.escape(str(self.local_dir)), entry)
+            matches = sorted(os.path.relpath(match, self.local_dir) for match in glob.glob(pattern)) or [entry]
+
+        for match in matches:
+            local_file = self._local_path(match)
+            if not local_file.is_dir():
+                yield match
+                continue
+
+            for root, dirs, names in os.walk(local_file):
+                dirs.sort()
+                relative = Path(match) / Path(root).relative_to(local_file)
+                for name in sorted(names):
+                    yield (relative / name).as_posix()
+
+
+    def _walk_remote(self, session, entry):
+        """Class method (generator) that yields the remote file(s) a --file entry stands for"""
+
+        directory, name = posixpath.split(entry.rstrip('/'))
+        ftp = session()
+        listing = self._remote_listing(ftp, directory) if ftp else None
+
+        if listing is None:
+            if ftp and glob.has_magic(name):
+                # no MLSD: match the names from NLST, subdirectories can't be told apart from files
+                try:
+                    names = [posixpath.basename(path) for path in ftp.nlst(directory)]
+                except ftplib.error_perm:
+                    names = []
+                matches = sorted(fnmatch.filter(names, name))
+                yield from (posixpath.join(directory, match) for match in matches) if matches else [entry]
+            else:
+                yield entry
+            return
+
+        if glob.has_magic(name):
+            # nothing matching is left as is, the download of it fails like any missing file
+            matches = sorted(match for match in listing if fnmatch.fnmatchcase(match, name)) or [name]
+        else:
+            matches = [name]
+
+        for match in matches:
+            path = posixpath.join(directory, match)
+            if listing.get(match, {}).get('type') == 'dir':
+                yield from self._walk_remote_dir(session, path)
+            else:
+                yield path
+
+
+    def _walk_remote_dir(self, session, directory):
+        """Class method (generator) that yields every file of a remote directory tree, one MLSD per directory"""
+
+        for name, facts in sorted((self._remote_listing(session(), directory) or {}).items()):
+            path = posixpath.join(directory, name)
+            if facts['type'] == 'dir':
+                yield from self._walk_remote_dir(session, path)
+            else:
+                yield path
+
+
+    def _feed_queue(self, session, work_queue):
+        """
+        Class method that streams the expanded file list into the work queue, then one end of
+        the queue (None) for every session
+        """
+
+        try:
+            for next_file in self._bundle_small_files(self._expand_files(session), session):
+                work_queue.put(next_file)
+        except ftplib.all_errors as e:
+            self.logger.error(f'Unable to list the remote files ({e})')
+        finally:
+            for _ in range(self.parallel):
+                work_queue.put(None)
+
+
+    def _set_local_mtime(self, ftp, next_file):
+        """Class method (--sync) to give a downloaded file the remote file's modification time"""
+
+        remote = self._remote_facts(ftp, next_file)
+        if remote:
+            os.utime(self._local_path(next_file), (remote['modify'], remote['modify']))
+
+
+    def _log_sync_summary(self):
+        if self.sync:
+            self.logger.info(f'{len(self.skipped)} file(s) already up to date, '
+                             f'{format_size(sum(self.skipped.values()))} not transferred')
+
+
+class AsyncFtpSession():
+    """
+    Minimal FTP control connection on top of asyncio streams, speaking just enough of the protocol
+    for the gateway login, the remote host login (USER user@host) and binary RETR/STOR.
+    Errors are raised as the same ftplib exceptions (ftplib.all_errors) the blocking engine uses.
+
+    Attributes:
+    reader (asyncio.StreamReader object): Control connection, incoming
+    writer (asyncio.StreamWriter object): Control connection, outgoing
+    limit (int): Buffer limit of the data connections; the transport stops reading when it's reached
+    """
+
+    def __init__(self, reader, writer, limit):
+        self.reader = reader
+        self.writer = writer
+        self.limit = limit
+        self.welcome = None
+
+
+    @classmethod
+    async def connect(cls, host, limit=DEFAULT_BLOCKSIZE * 2, port=None):
+        reader, writer = await asyncio.open_connection(host, port or GATEWAY_PORT)
+        session = cls(reader, writer, limit)
+        session.welcome = await session.getresp()
+        return session
+
+
+    async def getresp(self):
+        """
+        Class method to read a (possibly multi-line) reply and raise the matching ftplib error for 4xx/5xx
+
+        Returns:
+        The reply as a string
+        """
+
+        line = (await self.reader.readline()).decode(errors='replace').rstrip('\r\n')
+        if not line:
+            raise EOFError('Connection closed by the server')
+
+        reply = line
+        if line[3:4] == '-':
+            # multi-line reply, ends with a line that starts with the same code followed by a space
+            while not (line[:3] == reply[:3] and line[3:4] == ' '):
+                line = (await self.reader.readline()).decode(errors='replace').rstrip('\r\n')
+                if not line:
+                    raise EOFError('Connection closed by the server')
+                reply += f'\n{line}'
+
+        code = reply[:1]
+        if code == '4':
+            raise ftplib.error_temp(reply)
+        if code == '5':
+            raise ftplib.error_perm(reply)
+        if code not in '123':
+            raise ftplib.error_proto(reply)
+        return reply
+
+
+    async def sendcmd(self, cmd):
+        self.writer.write(f'{cmd}\r\n'.encode())
+        await self.writer.drain()
+        return await self.getresp()
+
+
+    async def voidresp(self):
+        reply = await self.getresp()
+        if reply[:1] != '2':
+            raise ftplib.error_reply(reply)
+        return reply
+
+
+    async def voidcmd(self, cmd):
+        reply = await self.sendcmd(cmd)
+        if reply[:1] != '2':
+            raise ftplib.error_reply(reply)
+        return reply
+
+
+    async def login(self, user, passwd):
+        reply = await self.sendcmd(f'USER {user}')
+        if reply[:1] == '3':
+            reply = await self.sendcmd(f'PASS {passwd}')
+        if reply[:1] != '2':
+            raise ftplib.error_reply(reply)
+        return reply
+
+
+    async def size(self, filename):
+        reply = await self.sendcmd(f'SIZE {filename}')
+        if reply[:3] == '213':
+            return int(reply[3:].strip())
+
+
+    async def transfercmd(self, cmd, rest=None):
+        """
+        Class method to open a passive data connection and send the transfer command
+
+        Returns:
+        A tuple of the data connection's asyncio.StreamReader and asyncio.StreamWriter objects
+        """
+
+        # same as ftplib, connect to the control connection's host rather than the address in the 227 reply
+        untrusted_host, port = ftplib.parse227(await self.sendcmd('PASV'))
+        host = self.writer.get_extra_info('peername')[0]
+        reader, writer = await asyncio.open_connection(host, port, limit=self.limit)
+
+        try:
+            if rest is not None:
+                await self.sendcmd(f'REST {rest}')
+            reply = await self.sendcmd(cmd)
+            if reply[:1] == '2':
+                reply = await self.getresp()
+            if reply[:1] != '1':
+                raise ftplib.error_reply(reply)
+        except ftplib.all_errors:
+            writer.close()
+            raise
+
+        return reader, writer
+
+
+    async def alive(self):
+        """Class method that tells if the control connection still answers (NOOP), same as session_alive"""
+
+        try:
+            await self.voidcmd('NOOP')
+        except ftplib.all_errors:
+            return False
+        return True
+
+
+    async def close(self):
+        with contextlib.suppress(*ftplib.all_errors):
+            await asyncio.wait_for(self.voidcmd('QUIT'), 5)
+        self.writer.close()
+        with contextlib.suppress(OSError):
+            await self.writer.wait_closed()
+
+
+class AsyncFtpConnection(FtpConnection):
+    """
+    Transfer engine (--engine async) that multiplexes all of its gateway sessions (--parallel of them)
+    on one thread with asyncio, instead of one blocking ftplib.FTP per thread.
+    Same gateway-then-remote host login and binary RETR/STOR as FtpConnection.
+    """
+
+    def _connect_and_transfer(self):
+        asyncio.run(self._run())
+
+
+    async def _run(self):
+        sessions = min(self.parallel, len(self.files))
+        work_queue = asyncio.Queue()
+
+        for next_file in self.files:
+            work_queue.put_nowait(next_file)
+
+        self.logger.info(
+            f'Opening {sessions} session(s) through the {self.gate_location.title()} Gate ({self.gateway}) [async engine]...')
+        self.logger.info(
+            'Please approve the push notification(s) (sign-in request) in your "VIP Access" mobile app...')
+        self.logger.info(f'Transferring files to/from {self.remote_dir}')
+
+        # the progress bar only makes sense if the files go one after another
+        show_progress = self.show_progress and sessions == 1
+        await asyncio.gather(*(self._transfer_worker(n, work_queue, show_progress) for n in range(1, sessions + 1)))
+
+        self.logger.info(dash_line)
+
+        if not self.results:
+            raise GatewayConnectionError(self.logger, self.gateway, self.gate_location)
+
+        failed = [next_file for next_file in self.files if self.results.get(next_file) is None]
+        total = sum(size for size in self.results.values() if size)
+        self.logger.info(
+            f'{len(self.files) - len(failed)} of {len(self.files)} file(s) transferred, {total} bytes in total')
+
+        if failed:
+            self.logger.error(f'Failed to {self.action}: {", ".join(failed)}')
+            self.logger.info(dash_line)
+            raise TerminateTheScript(self.logger)
+
+        self.logger.info(dash_line)
+
+
+    async def _open_session(self):
+        session = await AsyncFtpSession.connect(self.gateway, limit=self.blocksize * 2)
+        try:
+            with METRICS.timed('login_gateway', {'gateway': self.gateway}):
+                await session.login(self.gate_user, self.gate_pwd)
+            with METRICS.timed('login_remote_host', {'gateway': self.gateway, 'host': self.remote_host}):
+                await session.sendcmd(f'USER {self.remote_user}@{self.remote_host}')
+                await session.voidcmd(f'PASS {self.remote_pwd}')
+
+            if self.remote_dir != 'home':
+                await session.voidcmd(f'CWD {self.remote_dir}')
+
+            await session.voidcmd('TYPE I')
+        except ftplib.all_errors:
+            await session.close()
+            raise
+
+        return session
+
+
+    async def _transfer_worker(self, session_no, work_queue, show_progress):
+        prefix = f'[session {session_no}]'
+
+        try:
+            session = await self._open_session()
+        except ftplib.all_errors as e:
+            self.logger.error(f'{prefix} Unable to login to {self.remote_user}@{self.remote_host} ({e})')
+            return
+
+        self.logger.info(f'{prefix} Logged in: {self.remote_user}@{self.remote_host}')
+
+        try:
+            while not work_queue.empty():
+                next_file = work_queue.get_nowait()
+                self.logger.info(f'{prefix} Starting {self.action} of {next_file}...')
+
+                transferred, session = await self._transfer_with_retry(session, next_file, show_progress, prefix)
+                self.results[next_file] = transferred
+
+                if transferred is not None:
+                    self.logger.info(
+                        f'{prefix} {next_file}: file transfer successful, transferred {transferred} bytes')
+                elif not session:
+                    # the next file's _transfer_with_retry opens a new session
+                    self.logger.warning(f'{prefix} Session lost, a new one is opened for the next file')
+        finally:
+            if session:
+                await session.close()
+
+        self.logger.info(f'{prefix} FTP connection closed')
+
+
+    async def _transfer_with_retry(self, session, next_file, show_progress=True, prefix=''):
+        """
+        Class method to transfer a file (see _transfer_file), trying again the same way as the blocking engine
+        (see FtpConnection._transfer_with_retry): up to self.retries times after a transient error (4xx reply,
+        lost connection), waiting longer and longer, over a new session if the control connection is gone.
+        A permanent error (5xx, e.g. 550 file not found) is not retried.
+
+        Returns:
+        Tuple of the bytes transferred (None if it failed, see _transfer_file) and
+        the session to carry on with (None if it was lost and couldn't be opened again)
+        """
+
+        start = time.perf_counter()
+        attempts = self.retries + 1
+        for attempt in range(1, attempts + 1):
+            try:
+                if not session:
+                    self.logger.info(f'{prefix} Reconnecting to {self.remote_user}@{self.remote_host}...')
+                    self.logger.info(
+                        f'{prefix} Please approve the push notification (sign-in request) in your "VIP Access" mobile app...')
+                    session = await self._open_session()
+
+                transferred = await self._transfer_file(session, next_file, show_progress)
+                METRICS.record('transfer', time.perf_counter() - start, dict(self._metric_labels(), status='ok'),
+                               nbytes=transferred, file=next_file, attempts=attempt)
+                return transferred, session
+
+            except ftplib.error_perm as e:
+                error = e
+                break
+
+            except ftplib.all_errors as e:
+                error = e
+                delay = self._backoff(attempt)
+                if session and not await session.alive():
+                    await session.close()
+                    session = None
+
+            if attempt < attempts:
+                self.logger.warning(f'{prefix} {next_file}: {error}, trying again in {delay:.1f}s '
+                                    f'(attempt {attempt + 1} of {attempts})')
+                await asyncio.sleep(delay)
+
+        self.logger.error(f'{prefix} {next_file}: {self.action} failed ({error})')
+        METRICS.record('transfer', time.perf_counter() - start, dict(self._metric_labels(), status='failed'),
+                       file=next_file, attempts=attempt, error=str(error))
+        if self.action == 'download':
+            self._discard_partial_download(next_file)
+
+        return None, session
+
+
+    async def _transfer_file(self, session, next_file, show_progress=True):
+        """
+        Class method to download or upload a single file over an already logged in session.
+        Reads only ask for the next block once the previous one is written, and writes wait
+        for the data connection to drain, so neither side buffers more than a couple of blocks.
+
+        Returns:
+        Size (in bytes) of the remote file after the transfer, as counted while transferring it
+        """
+
+        local_file = self._local_path(next_file)
+
+        if self.action == 'download':
+            # the size is only worth a SIZE round trip for the progress bar (and it's nothing but a hint for preallocate)
+            progress = TransferProgress(await session.size(next_file) if show_progress else None, enabled=show_progress)
+            reader, writer = await session.transfercmd(f'RETR {next_file}')
+
+            try:
+                with open(self._partial_path(next_file), 'wb', buffering=WRITE_BUFFER) as new_file:
+                    preallocate(new_file, progress.total)
+                    while True:
+                        block = await reader.read(self.blocksize)
+                        if not block:
+                            break
+                        if self.rate_limiter:
+                            await asyncio.sleep(self.rate_limiter.reserve(len(block)))
+                        new_file.write(block)
+                        progress.update(len(block))
+                    new_file.truncate()
+            finally:
+                writer.close()
+        else:
+            progress = TransferProgress(local_file.stat().st_size, enabled=show_progress)
+            reader, writer = await session.transfercmd(f'STOR {next_file}')
+
+            try:
+                with open(local_file, 'rb') as new_file:
+                    while True:
+                        block = new_file.read(self.blocksize)
+                        if not block:
+                            break
+                        if self.rate_limiter:
+                            await asyncio.sleep(self.rate_limiter.reserve(len(block)))
+                        writer.write(block)
+                        await writer.drain()
+                        progress.update(len(block))
+            finally:
+                writer.close()
+                with contextlib.suppress(OSError):
+                    await writer.wait_closed()
+
+        progress.finish()
+        await session.voidresp()
+
+        if self.action == 'download':
+            os.replace(self._partial_path(next_file), local_file)
+
+        return progress.done
+
+
+class GatewaySessionPool():
+    """
+    Pool of sessions that are logged in to a Unix gate but not (yet) to a remote host.
+    Idle sessions are kept alive with a NOOP and the pool is topped up in the background,
+    so a transfer job only has to do the remote host login.
+    Once done with its remote host, a session is logged out of it (REIN) and given back (see release),
+    so the jobs for the other hosts behind the same Unix gate reuse it; if the Unix gate doesn't take
+    REIN, every session is used for a single remote host login and closed after, as before.
+
+    Attributes:
+    gateway (str): Unix gate
+    gate_location (str): Unix gate location
+    gate_user (str): Unix gate username
+    gate_pwd (str): IDLDAP.net password
+    logger (logging.Logger object) - Object that handles the FileHandler and StreamHandler
+    size (int): Number of idle sessions to keep ready
+    socket_buffer (int): SO_SNDBUF/SO_RCVBUF of the data connections; None leaves it to the OS
+    recycling (bool): Sessions are given back after use (until the Unix gate turns out not to support it)
+    busy (int): Sessions taken with get() and not given back yet
+    """
+
+    def __init__(self, gateway, gate_location, gate_user, gate_pwd, logger, size=1, socket_buffer=None):
+        self.gateway = gateway
+        self.gate_location = gate_location
+        self.gate_user = gate_user
+        self.gate_pwd = gate_pwd
+        self.logger = logger
+        self.size = max(1, size)
+        self.socket_buffer = socket_buffer
+        self.idle = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.recycling = True
+        self.busy = 0
+
+
+    def login(self):
+        """
+        Class method to open a new session and login to the Unix gate
+
+        Returns:
+        A GatewayFTP object logged in to the Unix gate
+        """
+
+        self.logger.info(f'Logging in to the {self.gate_location.title()} Gate ({self.gateway})...')
+        self.logger.info(
+            'Please approve the push notification (sign-in request) in your "VIP Access" mobile app...')
+
+        ftp = GatewayFTP(host=self.gateway, socket_buffer=self.socket_buffer, logger=self.logger)
+        try:
+            with METRICS.timed('login_gateway', {'gateway': self.gateway}):
+                ftp.login(user=self.gate_user, passwd=self.gate_pwd)
+        except ftplib.all_errors:
+            ftp.close()
+            raise
+
+        self.logger.info(f'User {self.gate_user} logged in')
+        return ftp
+
+
+    def get(self, recycled=True):
+        """
+        Class method to take an idle session out of the pool, or login a new one if there's none.
+        Every session taken has to be given back (release) or discarded once done with.
+
+        Arguments:
+        recycled (bool): A session already used for another remote host will do
+
+        Returns:
+        A GatewayFTP object logged in to the Unix gate
+        """
+
+        with self.lock:
+            sessions = [ftp for ftp in self.idle if recycled or not ftp.recycled]
+            ftp = sessions[-1] if sessions else None
+            if ftp:
+                self.idle.remove(ftp)
+            self.busy += 1
+
+        # let the background thread top up the pool
+        self.wakeup.set()
+
+        if ftp:
+            return ftp
+
+        try:
+            return self.login()
+        except ftplib.all_errors:
+            with self.lock:
+                self.busy -= 1
+            raise
+
+
+    def release(self, ftp):
+        """
+        Class method to give back a session once done with its remote host: logged out of the remote host
+        (REIN) but still logged in to the Unix gate, it's kept with the idle sessions, so the next job
+        (for any host behind the Unix gate) skips the TCP connection and the gate login with its
+        "VIP Access" approval. Closed instead if the pool has enough idle sessions already, or if the
+        Unix gate doesn't take REIN (then no other session is given back either).
+
+        Arguments:
+        ftp (GatewayFTP object): Session taken with get()
+        """
+
+        if not ftp.sock or not self.recycling or self.closed:
+            self.discard(ftp)
+            return
+
+        try:
+            ftp.voidcmd('REIN')
+        except ftplib.error_perm as e:
+            self.logger.info(f'The {self.gate_location.title()} Gate does not take REIN ({e}), sessions are not reused')
+            self.recycling = False
+            self.discard(ftp)
+            return
+        except ftplib.all_errors:
+            self.discard(ftp)
+            return
+
+        ftp.recycled = True
+        ftp.rate_limiter = None
+
+        with self.lock:
+            keep = len(self.idle) < self.size
+            if keep:
+                self.idle.append(ftp)
+            self.busy -= 1
+
+        if not keep:
+            with contextlib.suppress(*ftplib.all_errors):
+                ftp.quit()
+            ftp.close()
+
+
+    def discard(self, ftp):
+        """Class method to close a session taken with get() instead of giving it back (e.g. connection lost)"""
+
+        ftp.close()
+        with self.lock:
+            self.busy -= 1
+
+        # the session won't come back, so the background thread may have to login another one
+        self.wakeup.set()
+
+
+    def stop_recycling(self):
+        """Class method to stop giving sessions back (the Unix gate can't switch remote hosts), closing the recycled ones"""
+
+        self.recycling = False
+
+        with self.lock:
+            recycled = [ftp for ftp in self.idle if ftp.recycled]
+            self.idle = [ftp for ftp in self.idle if not ftp.recycled]
+
+        self.logger.info(f'Sessions to the {self.gate_location.title()} Gate can\'t switch remote hosts, they are not reused')
+        for ftp in recycled:
+            with contextlib.suppress(*ftplib.all_errors):
+                ftp.quit()
+            ftp.close()
+
+        self.wakeup.set()
+
+
+    def start(self):
+        """Class method to start the background thread that tops up the pool and keeps the idle sessions alive"""
+
+        threading.Thread(target=self._maintain, daemon=True).start()
+
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+
+        with self.lock:
+            sessions, self.idle = self.idle, []
+
+        for ftp in sessions:
+            with contextlib.suppress(*ftplib.all_errors):
+                ftp.quit()
+            ftp.close()
+
+
+    def _maintain(self):
+        while not self.closed:
+            # the busy sessions will be given back, no need to login new ones in the meantime
+            while len(self.idle) + (self.busy if self.recycling else 0) < self.size and not self.closed:
+                try:
+                    ftp = self.login()
+                except ftplib.all_errors as e:
+                    # don't keep on sending push notifications, try again on the next get()
+                    self.logger.error(f'Unable to login to the {self.gate_location.title()} Gate ({e})')
+                    break
+
+                with self.lock:
+                    self.idle.append(ftp)
+
+            self.wakeup.wait(KEEPALIVE_INTERVAL)
+            self.wakeup.clear()
+            self._keepalive()
+
+
+    def _keepalive(self):
+        """Class method to send a NOOP on every idle session, one at a time, dropping the ones that are gone"""
+
+        with self.lock:
+            count = len(self.idle)
+
+        for _ in range(count):
+            with self.lock:
+                if not self.idle:
+                    return
+                ftp = self.idle.pop(0)
+
+            try:
+                ftp.voidcmd('NOOP')
+            except ftplib.all_errors:
+                self.logger.warning(f'Idle session to the {self.gate_location.title()} Gate was dropped')
+                ftp.close()
+                continue
+
+            with self.lock:
+                self.idle.append(ftp)
+
+
+class JsonFormatter(logging.Formatter):
+    """Log formatter (--log-format json) that writes every record as one JSON object per line"""
+
+    def format(self, record):
+        line = {'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                'level': record.levelname, 'logger': record.name, 'thread': record.threadName,
+                'message': record.getMessage()}
+        if record.exc_info:
+            line['exception'] = self.formatException(record.exc_info)
+        return json.dumps(line)
+
+
+class JobLogHandler(logging.Handler):
+    """
+    Log handler that forwards the log records of a daemon job, as JSON lines,
+    to the fts.py invocation that submitted the job
+
+    Attribute:
+    wfile (file object): Writable end of the unix domain socket connection
+    """
+
+    def __init__(self, wfile):
+        super().__init__()
+        self.wfile = wfile
+
+
+    def emit(self, record):
+        # the client may have gone away (e.g. Ctrl+C), the job carries on regardless
+        with contextlib.suppress(OSError):
+            self.wfile.write(json.dumps({'level': record.levelno, 'msg': record.getMessage()}).encode() + b'\n')
+            self.wfile.flush()
+
+
+class DaemonRequestHandler():
+    """
+    Handles one transfer job (a JSON line) submitted by a later fts.py invocation. It's mixed into
+    socketserver.StreamRequestHandler by run_daemon (see request_handler), so only the daemon imports socketserver.
+    """
+
+    def handle(self):
+        daemon = self.server
+        # every job gets its own logger, writing to the daemon's log file and back to the client
+        job_logger = logging.Logger(f'{__name__}.job')
+        FTP = None
+        reply = {'status': 'failed'}
+
+        try:
+            job = parse_daemon_job(self.rfile.readline())
+
+            job_logger.addHandler(set_file_handler())
+            job_logger.addHandler(JobLogHandler(self.wfile))
+
+            daemon.logger.info(f'Job received: {job["action"]} {len(job["files"])} file(s) {job["remote_user"]}@{job["remote_host"]}')
+
+            FTP = FtpConnection(daemon.pool.gateway, daemon.pool.gate_location, daemon.pool.gate_user, daemon.pool.gate_pwd,
+                                job['server_grp'], job['ms_instance'], job['action'], job['files'], job['remote_host'],
+                                job['remote_user'], job['remote_pwd'], job['remote_dir'], job_logger,
+                                parallel=job['parallel'], show_progress=False, blocksize=job['blocksize'],
+                                socket_buffer=daemon.pool.socket_buffer, resume=job['resume'], segments=job['segments'],
+                                local_dir=job['local_dir'], pool=daemon.pool, compress=job['compress'],
+                                compress_post_command=job['compress_post_command'], sync=job['sync'],
+                                verify=job['verify'], retries=job['retries'], retry_backoff=job['retry_backoff'],
+                                rate_limit=job['rate_limit'], bundle_post_command=job['bundle_post_command'])
+
+            FTP.connect_and_transfer()
+            reply['status'] = 'ok'
+        except SystemExit:
+            # the custom exceptions end with TerminateTheScript, which would otherwise end the daemon
+            pass
+        except (ValueError,) + ftplib.all_errors as e:
+            # an invalid job (see parse_daemon_job), or an error not handled along the way (ftplib.all_errors
+            # takes in OSError, e.g. a full local disk): the sessions may be mid-transfer, so they don't go back to the pool
+            daemon.logger.error(f'Job failed ({e})')
+            if FTP:
+                FTP.discard_sessions()
+            reply['error'] = str(e)
+        finally:
+            # whatever happened to the job, the client gets its status
+            daemon.logger.info(f'Job finished: {reply["status"]}')
+
+            for handler in job_logger.handlers:
+                handler.close()
+
+            with contextlib.suppress(OSError):
+                self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+
+class MetricsRequestHandler():
+    """
+    Answers the HTTP GET /metrics requests (e.g. from Prometheus) with the totals of METRICS.
+    It's mixed into socketserver.StreamRequestHandler by serve_metrics (see request_handler).
+    """
+
+    def handle(self):
+        request = self.rfile.readline().decode('latin-1').split()
+        # the rest of the request (headers) is not needed
+        while self.rfile.readline().strip():
+            pass
+
+        if request[:2] == ['GET', '/metrics']:
+            status, body = '200 OK', METRICS.exposition().encode()
+        else:
+            status, body = '404 Not Found', b'Not found, try /metrics\n'
+
+        with contextlib.suppress(OSError):
+            self.wfile.write(f'HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                             f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+
+
+class JobLoggerAdapter(logging.LoggerAdapter):
+    """Logger adapter that prefixes every message with the job it belongs to (e.g. [job 3])"""
+
+    def process(self, msg, kwargs):
+        return f'[job {self.extra["job_no"]}] {msg}', kwargs
+
+
+def load_manifest(logger, file):
+    """
+    Function that reads the transfer jobs of a batch run from a JSON or CSV manifest file.
+
+    JSON: a list of objects, e.g.
+        [{"instance": "instance1", "action": "upload", "files": ["patch.zip"]},
+         {"host": "host1", "action": "download", "files": ["a.log", "b.log"], "remote_dir": "/var/log"}]
+    CSV: a header row of target,action,files,remote_dir where target is the MS instance
+        or non-MS host and files are separated by spaces
+
+    Arguments:
+    logger(logging.Logger object) - object that handles the FileHandler and StreamHandler
+    file(str) - Manifest file
+
+    Returns:
+    A list of dictionaries with target, action, files and remote_dir (None if not given) of every job
+    """
+
+    logger.info(f'Loading transfer jobs from the manifest ({file})...')
+
+    manifest = Path(file)
+    if not manifest.exists():
+        raise ConfigDoesNotExistError(logger, manifest)
+
+    jobs = []
+    try:
+        if manifest.suffix.lower() == '.json':
+            with open(manifest) as f:
+                for entry in json.load(f):
+                    files = entry['files']
+                    jobs.append({'target': entry.get('instance') or entry['host'], 'action': entry['action'],
+                                 'files': files.split() if isinstance(files, str) else list(files),
+                                 'remote_dir': entry.get('remote_dir')})
+        else:
+            with open(manifest, newline='') as f:
+                for row in csv.DictReader(f):
+                    jobs.append({'target': row['target'], 'action': row['action'],
+                                 'files': row['files'].split(), 'remote_dir': row.get('remote_dir') or None})
+
+    except (ValueError, KeyError, TypeError) as e:
+        logger.error(f'Manifest {manifest} is invalid ({e})')
+        raise TerminateTheScript(logger)
+
+    logger.info(f'{len(jobs)} job(s) loaded')
+    return jobs
+
+
+def resolve_manifest_job(job, client_accounts, non_ms_hosts_options, json_nonms_details, gate_username):
+    """
+    Function that looks up the server group, remote host credentials and remote directory of a manifest job
+
+    Arguments:
+    job (dict): Manifest job (see load_manifest)
+    client_accounts (dict): MS clients' environment information
+    non_ms_hosts_options (dict): Non-MS hosts
+    json_nonms_details (dict): Credentials of the non-MS hosts from the JSON file
+    gate_username (str): Unix gate username, part of the default MS remote directory
+
+    Returns:
+    A tuple of server group, MS instance, remote host, remote user, remote password and remote directory
+
+    Raises:
+    ValueError if the job can't be run as is (e.g. unknown target, missing credentials)
+    """
+
+    target = job['target']
+
+    if job['action'] not in ('download', 'upload'):
+        raise ValueError(f'unknown action ({job["action"]})')
+    if not job['files']:
+        raise ValueError('no files to transfer')
+
+    if target in client_accounts:
+        remote_user, remote_host_fqdn, remote_pwd, clientID = client_accounts[target]
+        remote_dir = job['remote_dir'] or f'aiprod{clientID}/implementor/{gate_username}'
+        return 'ms', target, remote_host_fqdn, remote_user, remote_pwd, remote_dir
+
+    host = target.lower()
+    if host in non_ms_hosts_options:
+        credentials = json_nonms_details.get(host, {})
+        if not credentials.get('username') or not credentials.get('password'):
+            raise ValueError(f'credentials for {host} missing from the JSON file ({JSON_CONFIG})')
+        if not job['remote_dir']:
+            raise ValueError('remote_dir is required for a non-MS host')
+        return ('nonms', None, non_ms_hosts_options[host], credentials['username'], credentials['password'],
+                job['remote_dir'])
+
+    raise ValueError(f'{target} is neither a MS instance nor a non-MS host')
+
+
+def run_manifest_job(job_no, job, pool, connection_args, summary):
+    """
+    Function (thread target) to run one manifest job over a session from the shared pool
+
+    Arguments:
+    job_no (int): Job number, used as prefix in the log
+    job (dict): Manifest job (see load_manifest)
+    pool (GatewaySessionPool object): Authenticated sessions to the Unix gate shared by all jobs
+    connection_args (dict): Other FtpConnection keyword arguments (e.g. blocksize, parallel)
+    summary (dict): job number as key, a tuple of status, bytes and duration as value
+    """
+
+    job_logger = JobLoggerAdapter(pool.logger, {'job_no': job_no})
+    started = time.monotonic()
+    status = 'failed'
+    transferred = 0
+
+    server_grp, ms_instance, remote_host_fqdn, remote_user, remote_pwd, remote_dir = job['resolved']
+
+    missing = [next_file for next_file in job['files']
+               if job['action'] == 'upload' and not Path(next_file).exists() and not glob.glob(next_file)]
+    if missing:
+        job_logger.error(f'{", ".join(missing)} does not exist in {Path().absolute()}')
+    else:
+        FTP = FtpConnection(pool.gateway, pool.gate_location, pool.gate_user, pool.gate_pwd,
+                            server_grp, ms_instance, job['action'], job['files'], remote_host_fqdn,
+                            remote_user, remote_pwd, remote_dir, job_logger, show_progress=False,
+                            socket_buffer=pool.socket_buffer, pool=pool, **connection_args)
+        job_logger.info(f'{job["action"].title()} of {len(job["files"])} file(s) with {remote_user}@{remote_host_fqdn}')
+
+        try:
+            FTP.connect_and_transfer()
+            status = 'ok'
+        except SystemExit:
+            # the custom exceptions end with TerminateTheScript, which would otherwise end the whole batch
+            pass
+        except OSError as e:
+            # local file errors (e.g. permission denied) only fail this job
+            job_logger.error(f'{e}')
+
+        transferred = sum(size for size in FTP.results.values() if size)
+
+    summary[job_no] = (status, transferred, time.monotonic() - started)
+
+
+def run_manifest(logger, jobs, pool, concurrency, connection_args):
+    """
+    Function to run the manifest jobs, at most `concurrency` at the same time, over sessions
+    from one shared pool and log a summary table at the end
+
+    Arguments:
+    logger (logging.Logger object) - Object that handles the FileHandler and StreamHandler
+    jobs (list): Manifest jobs, each with its 'resolved' tuple (see resolve_manifest_job)
+    pool (GatewaySessionPool object): Authenticated sessions to the Unix gate shared by all jobs
+    concurrency (int): Maximum number of jobs running at the same time
+    connection_args (dict): Other FtpConnection keyword arguments (e.g. blocksize, parallel)
+
+    Returns:
+    True if every job succeeded
+    """
+
+    summary = {}
+    work_queue = queue.Queue()
+    for job_no, job in enumerate(jobs, 1):
+        if job.get('error'):
+            logger.error(f'[job {job_no}] Skipped: {job["error"]}')
+            summary[job_no] = ('skipped', 0, 0.0)
+        else:
+            work_queue.put((job_no, job))
+
+    def worker():
+        while True:
+            try:
+                job_no, job = work_queue.get_nowait()
+            except queue.Empty:
+                return
+            # only keep as many sessions ready as the jobs still waiting can use
+            pool.size = min(concurrency, work_queue.qsize())
+            run_manifest_job(job_no, job, pool, connection_args, summary)
+
+    workers = [threading.Thread(target=worker) for _ in range(min(concurrency, work_queue.qsize()))]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    # summary table
+    logger.info(equal_sign_line)
+    logger.info(f'{"#":>3}  {"Target":<20} {"Action":<8} {"Files":>5} {"Transferred":>12} {"Time":>8}  Status')
+    for job_no, job in enumerate(jobs, 1):
+        status, transferred, duration = summary[job_no]
+        logger.info(f'{job_no:>3}  {job["target"]:<20} {job["action"]:<8} {len(job["files"]):>5} '
+                    f'{format_size(transferred):>12} {duration:>7.1f}s  {status}')
+
+    succeeded = sum(1 for status, transferred, duration in summary.values() if status == 'ok')
+    logger.info(f'{succeeded} of {len(jobs)} job(s) succeeded')
+    logger.info(equal_sign_line)
+
+    return succeeded == len(jobs)
+
+
+def request_handler(handler):
+    """
+    Function that returns the socketserver request handler class of DaemonRequestHandler or MetricsRequestHandler
+
+    Arguments:
+    handler (class): DaemonRequestHandler or MetricsRequestHandler
+
+    Returns:
+    A subclass of handler and socketserver.StreamRequestHandler
+    """
+
+    return type(handler.__name__, (handler, socketserver.StreamRequestHandler), {})
+
+
+def serve_metrics(logger, port):
+    """
+    Function to serve the /metrics endpoint (see MetricsRequestHandler) on 127.0.0.1, in the background
+
+    Arguments:
+    logger (logging.Logger object) - Object that handles the FileHandler and StreamHandler
+    port (int): TCP port to listen on
+
+    Returns:
+    The socketserver.ThreadingTCPServer object (shutdown() to stop it)
+    """
+
+    try:
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', port), request_handler(MetricsRequestHandler))
+    except OSError as e:
+        logger.error(f'Unable to serve the metrics on port {port} ({e})')
+        raise TerminateTheScript(logger)
+
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'Metrics served on http://127.0.0.1:{port}/metrics')
+    return server
+
+
+def daemon_socket(gateway):
+    """Function that returns the unix domain socket (Path object) of the daemon for a Unix gate"""
+
+    return DAEMON_DIR / f'{gateway}.sock'
+
+
+def run_daemon(logger, pool):
+    """
+    Function to hold authenticated sessions to a Unix gate and accept transfer jobs from later
+    fts.py invocations over a unix domain socket, until interrupted (Ctrl+C or SIGTERM)
+
+    Arguments:
+    logger (logging.Logger object) - Object that handles the FileHandler and StreamHandler
+    pool (GatewaySessionPool object) - Sessions to the Unix gate the daemon holds
+    """
+
+    if not hasattr(socket, 'AF_UNIX'):
+        logger.error('Daemon mode needs unix domain sockets, which this OS does not support')
+        raise TerminateTheScript(logger)
+
+    socket_path = daemon_socket(pool.gateway)
+    DAEMON_DIR.mkdir(mode=0o700, exist_ok=True)
+
+    # a leftover socket of a daemon that didn't shut down cleanly
+    with contextlib.suppress(FileNotFoundError):
+        socket_path.unlink()
+
+    # SIGTERM ends the daemon the same way Ctrl+C does
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+
+    pool.start()
+
+    with socketserver.ThreadingUnixStreamServer(str(socket_path), request_handler(DaemonRequestHandler)) as server:
+        # jobs carry the remote host credentials, so only the owner may connect
+        socket_path.chmod(0o600)
+        server.daemon_threads = True
+        server.logger = logger
+        server.pool = pool
+
+        logger.info(f'Daemon listening on {socket_path} (Ctrl+C to stop)')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print()
+        finally:
+            logger.info('Stopping the daemon...')
+            pool.close()
+            with contextlib.suppress(FileNotFoundError):
+                socket_path.unlink()
+
+
+def submit_to_daemon(logger, gateway, job):
+    """
+    Function to hand a transfer job over to a running daemon (fts.py --daemon) for the Unix gate
+
+    Arguments:
+    logger (logging.Logger object) - Object that handles the FileHandler and StreamHandler
+    gateway (str): Unix gate
+    job (dict): Transfer job details
+
+    Returns:
+    None if there's no daemon running for the Unix gate, otherwise True/False if the job succeeded/failed
+    """
+
+    socket_path = daemon_socket(gateway)
+    if not hasattr(socket, 'AF_UNIX') or not socket_path.exists():
+        return None
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except OSError:
+            logger.warning(f'Daemon for {gateway} is not responding, connecting directly')
+            return None
+
+        logger.info(f'Submitting the job to the daemon ({socket_path})...')
+        sock.sendall(json.dumps(job).encode() + b'\n')
+
+        # relay the daemon's log of the job until its final status
+        for line in sock.makefile('rb'):
+            message = json.loads(line)
+            if 'status' in message:
+                if 'error' in message:
+                    logger.error(f'Job failed in the daemon ({message["error"]})')
+                return message['status'] == 'ok'
+            logger.log(message['level'], message['msg'])
 
-    Attributes:
-    logger (logging.Logger object) - Object that handles the FileHandler and StreamHandler
-    config (str) - Missing configuration (directory or file)
-    """
+    logger.error('Daemon closed the connection before the job finished')
+    return False
 
-    def __init__(self, logger, config):
-        self.config = config
-        self.logger = logger
 
-        self.logger.error(f'{self.config} does not exist!')
-        raise TerminateTheScript(self.logger)
+def parse_daemon_job(line):
+    """
+    Function to parse and check a transfer job (a JSON line) submitted to the daemon (see submit_to_daemon)
 
+    Arguments:
+    line (bytes): JSON line read from the client
 
-class UploadFileDoesNotExistError(Error):
-    """Exception raised if the file to be uploaded does not exist
+    Returns:
+    The job (dict)
 
-    Attributes:
-    logger(logging.Logger object) - Object that handles the FileHandler and StreamHandler
-    file(Path object)
+    Raises:
+    ValueError if it isn't a job the daemon can run (not JSON, missing keys, unknown action, no files)
     """
 
-    def __init__(self, logger, file, curr_dir):
-        self.file = file
-        self.curr_dir = curr_dir
-        self.logger = logger
+    try:
+        job = json.loads(line)
+    except ValueError:
+        raise ValueError('invalid job, not a JSON line') from None
 
-        self.logger.error(f'{self.file} does not exist in {self.curr_dir}')
-        self.logger.info(dash_line)
-        raise TerminateTheScript(self.logger)
+    if not isinstance(job, dict):
+        raise ValueError('invalid job, not a JSON object')
+    missing = [key for key in DAEMON_JOB_KEYS if key not in job]
+    if missing:
+        raise ValueError(f'invalid job, missing {", ".join(missing)}')
+    if job['action'] not in ('download', 'upload'):
+        raise ValueError(f'invalid job, unknown action ({job["action"]})')
+    if not isinstance(job['files'], list) or not job['files'] or not all(isinstance(file, str) for file in job['files']):
+        raise ValueError('invalid job, files is not a list of files')
 
+    return job
 
-class TerminateTheScript(Error):
-    """Exception raised from the other custom exceptions to prematurely end the script
 
-    Attribute:
-    logger(logging.Logger object) - object that handles the FileHandler and StreamHandler
-    """
+def format_labels(labels):
+    """Function to format (label, value) tuples as Prometheus labels, e.g. {action="upload",status="ok"}"""
 
-    def __init__(self, logger):
-        self.logger = logger
+    if not labels:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{label}="{escape(value)}"' for label, value in labels) + '}'
 
-        self.logger.warning('Terminating script...')
-        self.logger.info('End of program')
-        self.logger.info(f'Logged everything in {LOG_FILE}')
-        self.logger.info('Thank you for using the script!')
-        self.logger.info(f'END - {t()}')
-        self.logger.info(equal_sign_line)
-        sys.exit()
 
+def new_compressor(codec):
+    """Function that returns a streaming compressor (compress/flush methods) for 'gzip' or 'zstd'"""
 
-class FtpConnection():
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor().compressobj()
+    # wbits 31: deflate with a gzip header and trailer, same as the gzip command
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
 
-    # next_f = None
-    upload_size = 0
 
-    def __init__(self, gateway, gate_location, gate_user, gate_pwd, server_grp, ms_instance, action, files, remote_host, remote_user, remote_pwd, remote_dir, logger):
-        self.gateway = gateway
-        self.gate_location = gate_location
-        self.gate_user = gate_user
-        self.gate_pwd = gate_pwd
-        self.server_grp = server_grp
-        self.ms_instance = ms_instance
-        self.action = action
-        self.files = files
-        self.remote_host = remote_host
-        self.remote_user = remote_user
-        self.remote_pwd = remote_pwd
-        self.remote_dir = remote_dir
-        self.logger = logger
-        self.host = f'MS host' if self.server_grp == 'ms' else f'non-MS host'
+def new_decompressor(codec):
+    """Function that returns a streaming decompressor (decompress method) for 'gzip' or 'zstd'"""
 
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
 
-    def _progress_bar(self, file_name, file_size, action):
-        """
-        Class method to calculate the size of file being transferred
-        and calling the _update_bar function to update and display
-        the progress bar
-        
-        """
-        runs = file_size
-        this_file = Path(file_name)
-        current_filesize = 0
-        counter = 0
 
-        while current_filesize <= file_size:
-            if action == 'download':
-                current_filesize = this_file.stat().st_size
-            else:
-                current_filesize = self.upload_size
+def gateway_rate_limiter(gateway, rate):
+    """
+    Function that returns the RateLimiter of a gateway, the same one for every transfer (parallel sessions,
+    segments, manifest or daemon jobs) through that gateway in this process
 
-            # print(current_filesize)
-            self._update_progress_bar(runs, current_filesize + 1)
-            
-            if current_filesize >= file_size:
-                time.sleep(1)
-                break
+    Arguments:
+    gateway (str): Unix gate
+    rate (int): Limit in bytes per second; a later, different limit replaces it for every transfer
+    """
 
+    with RATE_LIMITERS_LOCK:
+        limiter = RATE_LIMITERS.get(gateway)
+        if not limiter:
+            limiter = RATE_LIMITERS[gateway] = RateLimiter(rate)
+        elif limiter.rate != rate:
+            limiter.rate = rate
+            limiter.burst = max(DEFAULT_BLOCKSIZE, rate // 10)
+        return limiter
 
-    def _update_progress_bar(self, total, progress):
-        """
-        Class method to update and display the progress bar in the console.
 
-        Original source: https://stackoverflow.com/a/15860757/1391441
-        """
-        
-        barLength, status = 20, ""
-        progress = float(progress) / float(total)
-        if progress >= 1.:
-            progress, status = 1, "\r\n"
-        block = int(round(barLength * progress))
-        text = f'\r[{"#" * block + "-" * (barLength - block)}] {round(progress * 100, 0):.0f}% {status}'
-        sys.stdout.write(text)
-        sys.stdout.flush()
+def parse_rate(value):
+    """
+    Function to convert a bandwidth limit such as 500K, 10M or 1.5G (bytes per second, powers of 1024) to bytes
 
+    Returns:
+    The limit in bytes per second, None for no limit (0 or empty)
+    """
 
-    def connect_and_transfer(self):
-        self.logger.info(
-            f'Connecting to the {self.gate_location.title()} Gate ({self.gateway})...')
+    value = str(value).strip().upper().rstrip('B')
+    multiplier = 1
+    if value and value[-1] in 'KMG':
+        multiplier = 1024 ** ('KMG'.index(value[-1]) + 1)
+        value = value[:-1]
 
-        try:
-            with ftplib.FTP(host=self.gateway) as ftp:
-                self.logger.info(f'Connection established!')
-                welcome = ftp.getwelcome()
+    rate = int(float(value or 0) * multiplier)
+    if rate < 0:
+        raise ValueError(f'negative bandwidth limit: {value}')
+    return rate or None
 
-                if welcome:
-                    self.logger.info(
-                        f'A message from the server:\n{welcome}')
 
-                self.logger.info(
-                    'Please approve the push notification (sign-in request) in your "VIP Access" mobile app...')
+def session_alive(ftp):
+    """Function that tells if the control connection of a session still answers (NOOP)"""
 
-                # update Class attribute with the ftp object
-                self.ftp = ftp
-                # login to unix gate
-                self._login_to_gate()
+    try:
+        ftp.voidcmd('NOOP')
+    except ftplib.all_errors:
+        return False
+    return True
 
-        except ftplib.all_errors as e:
-            raise GatewayConnectionError(
-                self.logger, self.gateway, self.gate_location)
 
+def new_hasher(algorithm):
+    """Function that returns a new --verify checksum object (sha256, sha1, md5 or crc32)"""
 
-    def _login_to_gate(self):
+    return Crc32() if algorithm == 'crc32' else hashlib.new(algorithm)
 
-        try:
-            self.ftp.login(user=self.gate_user, passwd=self.gate_pwd)
-            self.logger.info(f'User {self.gate_user} logged in')
-            self._login_to_remote_host()
 
-        except ftplib.all_errors:
-            raise GatewayConnectionError(
-                self.logger, self.gateway, self.gate_location)
+def hash_file(file, hasher, size=None):
+    """Function to add the content of a local file (or only its first size bytes) to a checksum"""
 
-    def _login_to_remote_host(self):
-        # login to the chosen host (MS or non-MS)
-        try:
-            self.logger.info(f'Logging in to the {self.host}...')
-            self.ftp.sendcmd(f'USER {self.remote_user}@{self.remote_host}')
-            self.ftp.sendcmd(f'PASS {self.remote_pwd}')
-            self.logger.info(
-                f'Logged in: {self.remote_user}@{self.remote_host}')
-            self._transfer_files()
-            self.ftp.close()
-            self.logger.info('FTP connection closed')
-            self.logger.info('Disconnected from server')
+    remaining = size
+    with open(file, 'rb') as f:
+        while remaining is None or remaining > 0:
+            block = f.read(WRITE_BUFFER if remaining is None else min(WRITE_BUFFER, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            if remaining is not None:
+                remaining -= len(block)
 
-        except ftplib.all_errors:
-            raise RemoteHostConnectionError(
-                self.logger, self.remote_user, self.remote_host)
 
-    def _update_remote_filesize(self, x):
-        """
-        Class method to update the instance variable (upload_size) to calculate every block of data transferred
+def parse_ftp_time(value):
+    """
+    Function to convert a MLSD modify fact or MDTM reply value (YYYYMMDDHHMMSS[.sss], UTC)
+    to seconds since the epoch
+    """
 
-        """
-        # seems that the ftp.size() method isn't "friendly" if done repeatedly in the _progress_bar function
-        # and it's getting mixed results. have to devise a workaround which is thru an instance variable
-        # update this variable every block of data that is uploaded
-        self.upload_size += 8192
+    value = value.strip()
+    return int(datetime.datetime(int(value[:4]), int(value[4:6]), int(value[6:8]), int(value[8:10]),
+                                 int(value[10:12]), int(value[12:14]), tzinfo=datetime.timezone.utc).timestamp())
 
 
-    def _transfer_files(self):
-        if self.server_grp == 'ms':
-            self.logger.info(
-                f'By default, transferring files to/from {self.remote_dir}')
+def preallocate(file, size):
+    """
+    Function to reserve the disk space of a file about to be written (posix_fallocate),
+    which saves the filesystem from growing it block by block and fragmenting it.
+    Not every OS/filesystem supports it, so it's only a best effort.
 
-        try:
-            self.logger.info(f'Currently in $HOME ({self.ftp.pwd()})')
+    Arguments:
+    file (file object): File opened for writing
+    size (int): Final size (in bytes) of the file
+    """
 
-            changed_dir = False
-            if self.remote_dir != 'home':
-                self.logger.info(f'Changing directory to: {self.remote_dir}')
-                self.ftp.cwd(self.remote_dir)
-                changed_dir = True
+    if size and hasattr(os, 'posix_fallocate'):
+        with contextlib.suppress(OSError):
+            os.posix_fallocate(file.fileno(), 0, size)
 
-            self.logger.info('Switching to Binary mode.')
-            self.ftp.sendcmd('TYPE I')
 
-            for next_file in self.files:
-                downloaded = False
-                uploaded = False
-                self.logger.info(dash_line)
-                self.logger.info(f'Starting {self.action} of {next_file}...')
-                
-
-                if self.action == 'download':
-                    with open(next_file, 'wb') as new_file:
-                        file_size = self.ftp.size(next_file)
-                        
-                        # prepare the thread to display the progress bar for file transfer
-                        thread_d = threading.Thread(target=self._progress_bar, args=(next_file, file_size, self.action))
-                        
-                        thread_d.start()
-                        self.ftp.retrbinary(cmd=f'RETR {next_file}', callback=new_file.write)
-                        thread_d.join()
-                        downloaded = True
-                else:
-                    with open(next_file, 'rb') as new_file:
-                        file_size = Path(next_file).stat().st_size
-                        self.upload_size = 0
-
-                        # prepare the thread to display the progress bar for file transfer
-                        thread_u = threading.Thread(target=self._progress_bar, args=(next_file, file_size, self.action))
-                        
-                        thread_u.start()
-                        self.ftp.storbinary(f'STOR {next_file}', new_file, callback=self._update_remote_filesize)
-                        thread_u.join()
-                        
-                        uploaded = True
-
-                if downloaded or uploaded:
-                    self.logger.info(
-                        f'File transfer successful, transferred {self.ftp.size(next_file)} bytes')
-            self.logger.info(dash_line)
+def format_size(nbytes):
+    """Function to format a number of bytes into a human readable string (e.g. 1.5 MiB)"""
 
-        except ftplib.all_errors:
-            if not changed_dir:
-                self.logger.error(
-                    f'{self.remote_dir} does not exist in the remote host!')
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if nbytes < 1024 or unit == 'GiB':
+            return f'{nbytes:.0f} {unit}' if unit == 'B' else f'{nbytes:.1f} {unit}'
+        nbytes /= 1024
 
-            if self.action == 'download' and not downloaded:
-                self.logger.error(
-                    f'{next_file} does not exist in {self.remote_dir} !')
-                # in case of download failure, delete the local file
-                local_file = Path(next_file)
-                if local_file.exists():
-                    self.logger.info('Download failed. Deleting local copy...')
-                    local_file.unlink()
-            
 
-            self.logger.info(dash_line)
-            self.ftp.close()
-            self.logger.info('FTP connection closed')
-            self.logger.info('Disconnected from server')
-            raise TerminateTheScript(self.logger)
+def format_duration(seconds):
+    """Function to format a number of seconds into MM:SS (or HH:MM:SS for long transfers)"""
+
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02}:{seconds:02}' if hours else f'{minutes:02}:{seconds:02}'
 
 
 def set_console_handler(level):
@@ -401,28 +3799,101 @@ def set_console_handler(level):
 
 
 def set_file_handler():
-    """Function to set the FileHandler log handler
-        
+    """Function to set the log handler of the log file: it only queues the records for the
+    background writer (started with the defaults if it isn't yet, see start_log_writer)
+
+    Returns:
+    file_handler (QueueHandler object): log handler that hands the records over to the log file writer
+    """
+
+    if not LOG_LISTENER:
+        start_log_writer()
+    return logging.handlers.QueueHandler(LOG_QUEUE)
+
+
+def start_log_writer(log_format='text', rotate='size'):
+    """
+    Function to start the background thread that takes the log records off LOG_QUEUE and writes them
+    to LOG_FILE (and the JSON lines of METRICS_LOGGER to METRICS_FILE), until the program ends
+
+    Arguments:
+    log_format (str): text (same lines as the console), or json (one JSON object per line)
+    rotate (str): size (every LOG_MAX_BYTES) or daily (at midnight), keeping LOG_BACKUP_COUNT gzipped logs
+    """
+
+    global LOG_LISTENER
+
+    file_handler = rotating_file_handler(LOG_FILE, rotate)
+    file_handler.setFormatter(JsonFormatter() if log_format == 'json' else FORMATTER)
+    file_handler.addFilter(lambda record: record.name != METRICS_LOGGER)
+
+    # the metrics records are JSON lines already
+    metrics_handler = rotating_file_handler(METRICS_FILE, rotate)
+    metrics_handler.setFormatter(logging.Formatter('%(message)s'))
+    metrics_handler.addFilter(lambda record: record.name == METRICS_LOGGER)
+
+    metrics_logger = logging.getLogger(METRICS_LOGGER)
+    metrics_logger.setLevel(logging.INFO)
+    metrics_logger.addHandler(logging.handlers.QueueHandler(LOG_QUEUE))
+    metrics_logger.propagate = False
+
+    LOG_LISTENER = logging.handlers.QueueListener(LOG_QUEUE, file_handler, metrics_handler)
+    LOG_LISTENER.start()
+
+    # whatever is still queued gets written before the program ends (sys.exit included)
+    atexit.register(LOG_LISTENER.stop)
+
+
+def rotating_file_handler(file, rotate):
+    """
+    Function that returns the handler of a file written by the log writer thread
+
+    Arguments:
+    file (Path): LOG_FILE or METRICS_FILE
+    rotate (str): size (every LOG_MAX_BYTES) or daily (at midnight), keeping LOG_BACKUP_COUNT gzipped files
+
     Returns:
-    file_handler (FileHandler object): log handler that writes to the log file
+    A RotatingFileHandler or TimedRotatingFileHandler object
     """
 
-    file_handler = logging.FileHandler(LOG_FILE)
-    file_handler.setFormatter(FORMATTER)
-    return file_handler
+    if rotate == 'daily':
+        handler = logging.handlers.TimedRotatingFileHandler(file, when='midnight', backupCount=LOG_BACKUP_COUNT)
+    else:
+        handler = logging.handlers.RotatingFileHandler(file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+
+    # the old files are compressed by the writer thread as well, when it rotates them
+    handler.namer = lambda name: f'{name}.gz'
+    handler.rotator = compress_log
+    return handler
+
+
+def compress_log(source, dest):
+    """Function (rotator of the log file handler) to gzip the log file being rotated (source) into dest"""
+
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        for block in iter(lambda: f_in.read(1024 * 1024), b''):
+            f_out.write(block)
+    os.remove(source)
 
 
-def get_logger(name, level=logging.DEBUG):
+def get_logger(name, level=logging.DEBUG, log_format='text', rotate='size'):
     """Function to create the log handler
-    
+
+    Arguments:
+    name (str): Logger name
+    level (int): Level of the messages shown on the console (everything goes to the log file)
+    log_format, rotate (str): Format and rotation of the log file (see start_log_writer)
+
     Returns:
-    A logging.Logger object with FileHandler and StreamHandler objects
+    A logging.Logger object with QueueHandler (log file) and StreamHandler objects
     """
     # create a custom logger
     logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
 
-    # add handlers to the logger object
+    # the console stays synchronous so the messages and the user prompts come out in order
+    if not LOG_LISTENER:
+        start_log_writer(log_format, rotate)
     logger.addHandler(set_console_handler(level))
     logger.addHandler(set_file_handler())
 
@@ -461,7 +3932,10 @@ def load_json_config(logger, file):
     # csv-related configuration
     json_csv_details = data['fts_config']['csv']
 
-    return (json_gate_details, json_nonms_details, json_csv_details)
+    # transfer tuning (e.g. blocksize, socket_buffer); optional
+    json_transfer_details = data['fts_config'].get('transfer', {})
+
+    return (json_gate_details, json_nonms_details, json_csv_details, json_transfer_details)
 
 
 def check_config(logger, csv_files):
@@ -519,7 +3993,15 @@ def ask_user(logger, prompt, header=None, response_type='int', main_dict=None, m
             if header:
                 print(f'{equal_sign_line}\n{header}\n{len(header) * "-"}\n')
 
-            if main_dict or menu_dict:
+            answer = None
+            if menu_dict and echo and len(menu_dict) >= TYPEAHEAD_MIN_CHOICES and termios and sys.stdin.isatty():
+                # too many choices to list them all, the user narrows them down by typing instead
+                answer = type_ahead(menu_dict, quit=quit, column=column)
+                if answer is None:
+                    raise WeGotOurselvesAQuitter(logger)
+                answer = str(answer)
+
+            elif main_dict or menu_dict:
                 d = menu_dict if menu_dict else main_dict
                 # determine the length of the dictionary for right justification in the user menu
                 right_j = int(math.log10(len(d))) + 1
@@ -535,7 +4017,10 @@ def ask_user(logger, prompt, header=None, response_type='int', main_dict=None, m
                     print(f'{str(key).rjust(right_j)} : {value}', end=end_with)
                     counter += 1
 
-            if not echo:
+            if answer is not None:
+                # already chosen in the type-ahead filter
+                pass
+            elif not echo:
                 # for passwords, do not echo user input
                 answer = getpass.getpass(prompt=prompt)
             else:
@@ -582,6 +4067,75 @@ def ask_user(logger, prompt, header=None, response_type='int', main_dict=None, m
             return (main_value, menu_choice)
 
 
+def type_ahead(menu_dict, quit=True, column=4):
+    """
+    Function for the type-ahead filter of ask_user: reads the keyboard key by key and, after every keystroke,
+    renders only the menu entries matching what was typed so far (see MenuIndex)
+
+    Parameters:
+    menu_dict (dict): Menu number as key, value to display as value
+    quit (bool): Determine if Esc quits
+    column (int): Number of columns when displaying the matches
+
+    Returns:
+    The menu number chosen, None if the user quit
+    """
+
+    index = MenuIndex(menu_dict)
+    right_j = int(math.log10(max(menu_dict))) + 1 if isinstance(max(menu_dict), int) else 1
+    help_text = f'Type to filter, arrows to move, Enter to choose{", Esc to quit" if quit else ""}: '
+    fd = sys.stdin.fileno()
+    saved = termios.tcgetattr(fd)
+    query, selected, drawn = '', 0, 0
+
+    try:
+        # no line buffering and no echo, Ctrl-C still works
+        tty.setcbreak(fd)
+
+        while True:
+            keys = index.search(query)
+            shown = keys[:column * TYPEAHEAD_ROWS]
+            selected = max(0, min(selected, len(shown) - 1))
+
+            lines = []
+            for row in range(0, len(shown), column):
+                cells = []
+                for n, key in enumerate(shown[row:row + column], start=row):
+                    cell = f'{str(key).rjust(right_j)} : {menu_dict[key]}'
+                    # the selected entry in reverse video
+                    cells.append(f'\x1b[7m{cell}\x1b[0m' if n == selected else cell)
+                lines.append('\t'.join(cells))
+            lines.append(f'({len(keys)} of {len(menu_dict)} match{"" if len(keys) == 1 else "es"}'
+                         f'{", showing the first " + str(len(shown)) if len(shown) < len(keys) else ""})')
+            lines.append(f'{help_text}{query}')
+
+            # back to the first line of the previous rendering, clear it and draw the new one
+            sys.stdout.write('\r' + (f'\x1b[{drawn - 1}A' if drawn > 1 else '') + '\x1b[J' + '\n'.join(lines))
+            sys.stdout.flush()
+            drawn = len(lines)
+
+            key = os.read(fd, 32).decode(errors='ignore')
+
+            if key in ('\r', '\n'):
+                if shown:
+                    return shown[selected]
+            elif key == '\x1b':
+                if quit:
+                    return None
+            elif key in ('\x1b[A', '\x1b[D', '\x1bOA', '\x1bOD'):
+                selected -= 1
+            elif key in ('\x1b[B', '\x1b[C', '\x1bOB', '\x1bOC', '\t'):
+                selected += 1
+            elif key in ('\x7f', '\x08'):
+                query, selected = query[:-1], 0
+            elif key.isprintable():
+                query, selected = query + key, 0
+
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, saved)
+        sys.stdout.write('\n')
+
+
 def parse_csv(filename, logger, sort=False,):
     """
     Function to parse a CSV file and store its information into a dictionary
@@ -589,16 +4143,21 @@ def parse_csv(filename, logger, sort=False,):
     Parameters:
     filename (str): CSV filename to be parsed
     sort (bool): If values need to be sorted prior to storing into menu dictionary
+                 (MS client accounts, which are also indexed)
 
     Returns:
-    A tuple of 2 dictionaries: one holds the main values while the other for the user menu
+    A tuple of 2 dictionaries: one holds the main values while the other for the user menu.
+    With sort, a 3rd dictionary indexes the client accounts: client_ids (sorted list of client IDs),
+    instances (client ID as key, sorted list of its instances as value) and hosts (lowercase hostname
+    as key, instance as value)
     """
 
     # global config_dir
     csv_file = CONFIG_DIR / f'{filename}'
-    csv_file = open(csv_file, newline='')
+    with open(csv_file, newline='') as f:
+        rows = list(csv.reader(f))
 
-    reader = csv.reader(csv_file)
+    reader = iter(rows)
 
     # parse the csv's header
     header_list = next(reader)
@@ -612,6 +4171,7 @@ def parse_csv(filename, logger, sort=False,):
     # if sort is True, temporarily put all instances in a list,
     # then sort later so menu will be in alphabetical order
     temp_list = []
+    index = {'client_ids': [], 'instances': {}, 'hosts': {}}
 
     for row in reader:
         val = row[0].lower()
@@ -626,6 +4186,9 @@ def parse_csv(filename, logger, sort=False,):
             # }
             temp_list.append(val)
             main_dict[row[0]] = tuple([row[0], row[1], row[2], row[3]])
+            index['instances'].setdefault(row[3], []).append(row[0])
+            # several instances may be on the same host
+            index['hosts'].setdefault(row[1].lower(), []).append(row[0])
         else:
             menu_dict[counter] = val
             main_dict[val] = row[1]
@@ -641,11 +4204,142 @@ def parse_csv(filename, logger, sort=False,):
             menu_dict[counter] = item
             counter += 1
 
-    logger.info(f'{csv_file.name} successfully loaded')
+        # sorted once here (and then cached), so the menus never have to go through all the instances
+        for instances in index['instances'].values():
+            instances.sort()
+        index['client_ids'] = sorted(index['instances'])
+
+        logger.info(f'{csv_file} successfully loaded')
+        return (main_dict, menu_dict, index)
+
+    logger.info(f'{csv_file} successfully loaded')
     # return both dictionaries as tuple
     return (main_dict, menu_dict)
 
 
+def load_csv_files(logger, csv_files):
+    """
+    Function to parse the CSV files (see parse_csv), or to load them as parsed from the cache file (CONFIG_CACHE)
+    if none of them changed since it was written, so the start up doesn't depend on how many clients are listed.
+    The cache holds the passwords of the CSV files, so it is only readable by the user (0600), and it isn't loaded
+    if it belongs to someone else or others can write to it (unpickling runs whatever is in the file)
+
+    Arguments:
+    logger (logging.Logger object) - Object that handles the FileHandler and StreamHandler
+    csv_files (list): Tuples of CSV filename (under CONFIG_DIR) and sort (see parse_csv)
+
+    Returns:
+    A list of (main dictionary, menu dictionary[, index]) tuples, in the order of csv_files
+    """
+
+    stamps = []
+    for filename, sort in csv_files:
+        csv_stat = (CONFIG_DIR / filename).stat()
+        stamps.append((filename, sort, csv_stat.st_size, csv_stat.st_mtime_ns))
+
+    try:
+        with open(CONFIG_CACHE, 'rb') as f:
+            cache_stat = os.fstat(f.fileno())
+            if cache_stat.st_uid != os.getuid() or stat.S_IMODE(cache_stat.st_mode) != 0o600:
+                raise PermissionError(f'{CONFIG_CACHE} is not a 0600 file of the current user')
+            cache = pickle.load(f)
+        if cache.get('version') == CONFIG_CACHE_VERSION and cache['stamps'] == stamps:
+            logger.info(f'{len(csv_files)} CSV files loaded from the cache ({CONFIG_CACHE})')
+            return cache['parsed']
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError, AttributeError) as e:
+        # no cache yet, or an unreadable (or untrusted) one: parse and write it again
+        logger.debug(f'Config cache not used ({e})')
+
+    parsed = [parse_csv(filename, logger, sort=sort) for filename, sort in csv_files]
+
+    try:
+        # written to a temporary file first, so another run never reads half a cache
+        temp_cache = CONFIG_CACHE.with_name(f'{CONFIG_CACHE.name}.{os.getpid()}')
+        # a left over of a run killed half way may have other permissions, created again so that it's 0600
+        with contextlib.suppress(FileNotFoundError):
+            temp_cache.unlink()
+        with os.fdopen(os.open(temp_cache, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+            pickle.dump({'version': CONFIG_CACHE_VERSION, 'stamps': stamps, 'parsed': parsed}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_cache, CONFIG_CACHE)
+    except OSError as e:
+        logger.debug(f'Unable to write the config cache ({e})')
+
+    return parsed
+
+
+def find_csv_rows(filename, key, match):
+    """
+    Function (generator) to read a CSV file (under CONFIG_DIR) line by line, only as far as the rows are needed.
+    Only the lines that contain key (lowercase) are parsed as CSV, the others are skipped as is
+
+    Arguments:
+    filename (str): CSV filename to be read
+    key (str): Lowercase text the line of the row needed contains
+    match (function): Called with the row (list of values, header excluded), returns True for a row needed
+
+    Yields:
+    The rows that match, in the order of the file
+    """
+
+    with open(CONFIG_DIR / filename, newline='') as f:
+        # skip the csv's header
+        next(f, None)
+        for line in f:
+            if key in line.lower():
+                for row in csv.reader([line]):
+                    if row and match(row):
+                        yield row
+
+
+def find_csv_row(filename, key, match):
+    """Function that returns the first row of a CSV file that matches (see find_csv_rows), or None"""
+
+    return next(find_csv_rows(filename, key, match), None)
+
+
+def lookup_csv_rows(logger, csv_files, gateway, instance):
+    """
+    Function for the runs where the Unix gate and the MS instance are both passed as arguments (e.g. cron jobs),
+    so no user menu will be shown: only the 2 rows needed are read instead of all the CSV files (see load_csv_files)
+
+    Arguments:
+    logger (logging.Logger object) - Object that handles the FileHandler and StreamHandler
+    csv_files (list): CSV filenames of the gateway hosts, server groups, non-MS hosts and MS client accounts
+    gateway (str): Unix gate passed (location or hostname)
+    instance (str): MS instance passed (or its hostname)
+
+    Returns:
+    The same list as load_csv_files (with these rows only), or None if either one is unrecognized
+    """
+
+    gateway_csv, server_group_csv, non_ms_servers_csv, ms_client_csv = csv_files
+
+    gateway_row = find_csv_row(gateway_csv, gateway.lower(), lambda row: gateway.lower() in (row[0].lower(), row[1]))
+    if not gateway_row:
+        return None
+
+    client_rows = list(find_csv_rows(ms_client_csv, instance.lower(), lambda row: row[0] == instance or row[1].lower() == instance.lower()))
+    # same as main with all the rows loaded: the hostname first, if it's the one of a single instance
+    host_rows = [row for row in client_rows if row[1].lower() == instance.lower()]
+    if len(host_rows) > 1:
+        # several instances on that host, the choice is left to the user (from all the rows)
+        return None
+    client_row = (host_rows or client_rows or [None])[0]
+    if not client_row:
+        return None
+
+    location, unix_gate = gateway_row[0].lower(), gateway_row[1]
+    instance_id, hostname, ftp_password, clientID = client_row[:4]
+    client_index = {'client_ids': [clientID], 'instances': {clientID: [instance_id]}, 'hosts': {hostname.lower(): [instance_id]}}
+
+    logger.info(f'{CONFIG_DIR / gateway_csv} and {CONFIG_DIR / ms_client_csv} looked up')
+    return [({location: unix_gate}, {1: location}),
+            # the server group is passed as well, so its menu is never needed
+            ({}, {}),
+            ({}, {}),
+            ({instance_id: (instance_id, hostname, ftp_password, clientID)}, {1: instance_id.lower()}, client_index)]
+
+
 def check_if_existing(logger, files):
     """Function which checks if file(s) to be uploaded exist locally
     
@@ -658,7 +4352,8 @@ def check_if_existing(logger, files):
     try:
         for item in files:
             x = Path(item)
-            if not x.exists():
+            # a directory is uploaded recursively, a (quoted) glob pattern needs at least one match
+            if not x.exists() and not glob.glob(item):
                 raise UploadFileDoesNotExistError(logger, x, current_dir)
     except UploadFileDoesNotExistError:
         pass
@@ -759,11 +4454,59 @@ def main():
     parser.add_argument('-s', '--server', choices=[
                         'ms', 'nonms'], help='transfer file(s) to either a Managed Services host or a non-MS host')
     parser.add_argument('-i', '--instance',
-                        help='Managed Services (only) client instance')
+                        help='Managed Services (only) client instance, or its hostname')
+    parser.add_argument('--client',
+                        help='Managed Services (only) client ID, to choose among its instances only (e.g. XRADI)')
     parser.add_argument(
         '-a', '--action', choices=['download', 'upload'], help='download or upload')
     parser.add_argument('-f', '--file', nargs='*',
-                        help='file(s) to be transferred; separated by spaces')
+                        help='file(s) to be transferred; separated by spaces. Directories are transferred recursively '
+                             'and quoted glob patterns (e.g. \'extract_2026*.dat\') are matched locally (upload) or remotely (download)')
+    parser.add_argument('--parallel', type=int, default=1, metavar='N',
+                        help='transfer the files over N gateway sessions at the same time (one "VIP Access" approval per session)')
+    parser.add_argument('--blocksize', type=int, metavar='BYTES',
+                        help=f'size of every block read/written during transfer. will override the value from JSON file (default {DEFAULT_BLOCKSIZE})')
+    parser.add_argument('--resume', action='store_true',
+                        help='keep partial files of failed transfers and continue interrupted transfers where they left off')
+    parser.add_argument('--segments', type=int, default=1, metavar='K',
+                        help=f'download each big file (at least {MIN_SEGMENT_SIZE // (1024 * 1024)} MiB per segment) as K byte ranges over K gateway sessions')
+    parser.add_argument('--manifest', metavar='FILE',
+                        help='batch run of the transfer jobs (MS instance or non-MS host, action, files, remote_dir) listed in a JSON or CSV file')
+    parser.add_argument('--concurrency', type=int, default=4, metavar='N',
+                        help='maximum number of manifest jobs running at the same time (default 4)')
+    parser.add_argument('--daemon', action='store_true',
+                        help='stay in the background holding authenticated gateway sessions (--parallel of them) and run the transfers of later invocations')
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='connect directly even if a daemon (--daemon) is running for the Unix gate')
+    parser.add_argument('--compress', choices=['gzip', 'zstd'],
+                        help='upload files compressed on the fly as <file>.gz/.zst (see compress_post_command in the JSON file), '
+                             'and decompress .gz/.zst downloads on the fly')
+    parser.add_argument('--bundle', action='store_true',
+                        help=f'upload the small files (up to {BUNDLE_FILE_SIZE // 1024} KiB) as tar bundles of up to {BUNDLE_MAX_FILES} files, '
+                             f'unpacked on the remote host by the bundle_post_command in the JSON file')
+    parser.add_argument('--sync', action='store_true',
+                        help='skip files that are already up to date (same size, not older) on the receiving side')
+    parser.add_argument('--verify', action='store_true',
+                        help='checksum every file while it is transferred and compare it with the remote one, '
+                             'transferring it again if they differ')
+    parser.add_argument('--retries', type=int, metavar='N',
+                        help=f'transfer a file up to N more times after a transient error, reconnecting if needed '
+                             f'(default: retries in the JSON file, else {DEFAULT_RETRIES})')
+    parser.add_argument('--limit', metavar='RATE',
+                        help='bandwidth limit (bytes per second, e.g. 500K or 10M) shared by all the transfers through the gateway; '
+                             '0 for none (default: rate_limit of the gateway in the JSON file, else the global one)')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help=f'with --daemon or --manifest, serve the login and transfer metrics (also in {METRICS_FILE}) '
+                             f'on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--engine', choices=['ftplib', 'async'], default='ftplib',
+                        help='transfer engine: blocking ftplib (default), or asyncio to multiplex many --parallel sessions on one thread')
+    parser.add_argument('--log-format', choices=['text', 'json'], default='text',
+                        help=f'format of {LOG_FILE}: text (default), or one JSON object per line')
+    parser.add_argument('--log-rotate', choices=['size', 'daily'], default='size',
+                        help=f'rotate {LOG_FILE} (and {METRICS_FILE}) when it reaches {LOG_MAX_BYTES // (1024 * 1024)} MiB (default) or daily, '
+                             f'keeping the last {LOG_BACKUP_COUNT} gzipped')
+    parser.add_argument('--no-progress', action='store_true',
+                        help='do not display the progress bar (automatically the case when the output is not a terminal)')
     parser.add_argument('-v', '--verbose', help=f'explain what is being done. though everything is logged in {LOG_FILE}',
                         action='store_const', const=logging.DEBUG, dest='loglevel', default=logging.ERROR)
     parser.add_argument(
@@ -771,8 +4514,50 @@ def main():
 
     args = parser.parse_args()
 
+    if args.parallel < 1:
+        parser.error('argument --parallel: must be at least 1')
+    if args.concurrency < 1:
+        parser.error('argument --concurrency: must be at least 1')
+    if args.segments < 1:
+        parser.error('argument --segments: must be at least 1')
+    if args.segments > 1 and args.parallel > 1:
+        parser.error('argument --segments: not allowed with argument --parallel')
+    if args.engine == 'async' and (args.resume or args.segments > 1 or args.daemon or args.manifest):
+        parser.error('argument --engine: async is not allowed with --resume, --segments, --daemon or --manifest')
+    if args.compress and (args.resume or args.segments > 1 or args.engine == 'async'):
+        parser.error('argument --compress: not allowed with --resume, --segments or --engine async')
+    if args.engine == 'async' and args.file and any(glob.has_magic(f) or Path(f).is_dir() for f in args.file):
+        parser.error('argument --engine: async only transfers plain files, not directories or glob patterns')
+    if args.sync and (args.compress or args.engine == 'async'):
+        parser.error('argument --sync: not allowed with --compress or --engine async')
+    if args.verify and args.engine == 'async':
+        parser.error('argument --verify: not allowed with --engine async')
+    if args.bundle and args.engine == 'async':
+        parser.error('argument --bundle: not allowed with --engine async')
+    if args.compress == 'zstd' and not zstandard:
+        parser.error('argument --compress: zstd needs the zstandard package (pip install zstandard)')
+    if args.limit is not None:
+        try:
+            parse_rate(args.limit)
+        except ValueError:
+            parser.error(f'argument --limit: invalid bandwidth limit: {args.limit}')
+    if args.retries is not None and args.retries < 0:
+        parser.error('argument --retries: must be at least 0')
+    if args.blocksize is not None and args.blocksize < 1:
+        parser.error('argument --blocksize: must be at least 1 byte')
+    if args.metrics_port is not None and not (args.daemon or args.manifest):
+        parser.error('argument --metrics-port: only allowed with --daemon or --manifest')
+
+    # the transfer threads (--parallel, --segments, the manifest's and the daemon's jobs) use these
+    if args.bundle or args.daemon:
+        preload(tarfile)
+    if args.compress == 'zstd' or args.daemon:
+        preload(zstandard)
+    if args.verify or args.daemon or args.manifest:
+        preload(hashlib)
+
     # create a logger object (that has both FileHandler and StreamHandler)
-    logger = get_logger(__name__, args.loglevel)
+    logger = get_logger(__name__, args.loglevel, log_format=args.log_format, rotate=args.log_rotate)
 
     logger.info(equal_sign_line)
     # logger.info(f'SCRIPT LOG - Start')
@@ -780,7 +4565,24 @@ def main():
     logger.info(f'File Transfer Script {__file__} [ Version {VERSION_NO} Build: {BUILD_DATE} at: {BUILD_TIME} ]')
 
     # obtain information from JSON file
-    json_gate_details, json_nonms_details, json_csv_details = load_json_config(logger, JSON_CONFIG)
+    json_gate_details, json_nonms_details, json_csv_details, json_transfer_details = load_json_config(logger, JSON_CONFIG)
+
+    # --blocksize argument takes precedence over the JSON file
+    blocksize = args.blocksize or json_transfer_details.get('blocksize') or DEFAULT_BLOCKSIZE
+    socket_buffer = json_transfer_details.get('socket_buffer') or None
+    # e.g. "SITE EXEC gunzip -f {file}" to decompress every --compress upload on the remote host
+    compress_post_command = json_transfer_details.get('compress_post_command') or None
+    # e.g. "SITE EXEC tar -xf {file} && rm -f {file}", needed by --bundle to unpack the bundles on the remote host
+    bundle_post_command = json_transfer_details.get('bundle_post_command') or None
+    if args.bundle and not bundle_post_command:
+        logger.error(f'--bundle needs the bundle_post_command (which unpacks a tar file) in {JSON_CONFIG}')
+        raise TerminateTheScript(logger)
+    bundle_post_command = bundle_post_command if args.bundle else None
+    retries = args.retries if args.retries is not None else json_transfer_details.get('retries', DEFAULT_RETRIES)
+    retry_backoff = json_transfer_details.get('retry_backoff', DEFAULT_RETRY_BACKOFF)
+    logger.info(f'Transfer block size: {blocksize} bytes')
+    if socket_buffer:
+        logger.info(f'Data connection socket buffers: {socket_buffer} bytes')
 
     csv_dir = json_csv_details['csv_dir']
     csv_files = json_csv_details['csv_files']
@@ -794,14 +4596,23 @@ def main():
 
     # =========================================================================
     # parse CSV files and load into dictionaries
+    csv_files = [(gateway_csv, False), (server_group_csv, False), (non_ms_servers_csv, False), (ms_client_csv, True)]
+
+    # fast path: with the Unix gate, server group and MS instance all passed, no menu will be shown
+    # so only their rows are looked up (if any of them is unrecognized, everything is loaded after all)
+    parsed = None
+    if args.gateway and args.server == 'ms' and args.instance and not (args.manifest or args.daemon):
+        parsed = lookup_csv_rows(logger, [filename for filename, sort in csv_files], args.gateway, args.instance)
+
     # UNIX gateway information
-    gateway_hosts, gateways_menu = parse_csv(gateway_csv, logger)
-    # server group option: MS or non-MS
-    server_groups, server_menu = parse_csv(server_group_csv, logger)
-    # non-MS host options
-    non_ms_hosts_options, non_ms_hosts_menu = parse_csv(non_ms_servers_csv, logger)
-    # MS clients' environment information
-    client_accounts, instance_menu = parse_csv(ms_client_csv, logger, sort=True)
+    # (from the cache unless one of the CSV files changed)
+    ((gateway_hosts, gateways_menu),
+     # server group option: MS or non-MS
+     (server_groups, server_menu),
+     # non-MS host options
+     (non_ms_hosts_options, non_ms_hosts_menu),
+     # MS clients' environment information
+     (client_accounts, instance_menu, client_index)) = parsed or load_csv_files(logger, csv_files)
 
     # =========================================================================
     # determine which parameters were and were not passed when calling the program
@@ -823,6 +4634,18 @@ def main():
     unix_gate, gateway_location = validate_or_ask_arg(
         logger, arg=args.gateway, header='Unix gate', prompt=choice_prompt, main_dict=gateway_hosts, menu_dict=gateways_menu, valid_dict=gateway_hosts)
 
+    # --limit takes precedence over the gate's own limit in the JSON file (by hostname or location), then the global one
+    gateway_limits = json_transfer_details.get('gateway_rate_limits', {})
+    limit = args.limit if args.limit is not None else gateway_limits.get(
+        unix_gate, gateway_limits.get(gateway_location, json_transfer_details.get('rate_limit', 0)))
+    try:
+        rate_limit = parse_rate(limit)
+    except ValueError:
+        logger.error(f'Invalid bandwidth limit in the JSON file ({JSON_CONFIG}): {limit}')
+        raise TerminateTheScript(logger)
+    if rate_limit:
+        logger.info(f'Bandwidth limit through {unix_gate}: {format_size(rate_limit)}/s')
+
     if args.username:
         gate_username = validate_or_ask_arg(
             logger, arg=args.username, header='Gateway username', prompt=username_prompt, response_type='str', quit=False)
@@ -845,6 +4668,59 @@ def main():
         logger.info(y('Unix gate', json_gate_pwd))
         gate_passcode = json_gate_pwd
 
+    if args.manifest:
+        # batch run: every job of the manifest shares the same (already loaded) configuration and gateway sessions
+        jobs = load_manifest(logger, args.manifest)
+        for job in jobs:
+            try:
+                job['resolved'] = resolve_manifest_job(
+                    job, client_accounts, non_ms_hosts_options, json_nonms_details, gate_username)
+            except ValueError as e:
+                job['error'] = str(e)
+
+        metrics_server = serve_metrics(logger, args.metrics_port) if args.metrics_port is not None else None
+
+        runnable = sum(1 for job in jobs if not job.get('error'))
+        pool = GatewaySessionPool(unix_gate, gateway_location, gate_username, gate_passcode, logger,
+                                  size=min(args.concurrency, runnable) or 1, socket_buffer=socket_buffer)
+        connection_args = {'parallel': args.parallel, 'blocksize': blocksize, 'resume': args.resume,
+                           'segments': args.segments, 'compress': args.compress,
+                           'compress_post_command': compress_post_command, 'sync': args.sync,
+                           'verify': args.verify, 'retries': retries, 'retry_backoff': retry_backoff,
+                           'rate_limit': rate_limit, 'bundle_post_command': bundle_post_command}
+        logger.info(equal_sign_line)
+        try:
+            if runnable:
+                # login all the sessions the first jobs need up front, so the "VIP Access" pushes come in together
+                pool.start()
+            all_succeeded = run_manifest(logger, jobs, pool, args.concurrency, connection_args)
+        finally:
+            pool.close()
+            if metrics_server:
+                metrics_server.shutdown()
+
+        if not all_succeeded:
+            raise TerminateTheScript(logger)
+
+        logger.info('End of program')
+        logger.info(f'Logged everything in {LOG_FILE}')
+        logger.info('Thank you for using the script!')
+        logger.info(f'END - {t()}')
+        logger.info(equal_sign_line)
+        return
+
+    if args.daemon:
+        # hold --parallel authenticated sessions to the Unix gate until stopped
+        pool = GatewaySessionPool(unix_gate, gateway_location, gate_username, gate_passcode, logger,
+                                  size=args.parallel, socket_buffer=socket_buffer)
+        if args.metrics_port is not None:
+            serve_metrics(logger, args.metrics_port)
+        run_daemon(logger, pool)
+        logger.info('End of program')
+        logger.info(f'END - {t()}')
+        logger.info(equal_sign_line)
+        return
+
     if args.server == 'nonms':
         if args.instance:
             logger.warning(
@@ -900,42 +4776,54 @@ def main():
 
     else:
         # user wants to tranfer file(s) to a MS host
+        host_instances = None
         if args.instance:
             # if --instance argument passed, then look up for the values in the client_accounts dictionary
-            try:
-                remote_user, remote_host_fqdn, remote_pwd, clientID = client_accounts[args.instance]
-            except KeyError:
+            # (the instance's hostname works too, if only one instance is on that host)
+            instances = client_index['hosts'].get(args.instance.lower(), [args.instance])
+            if len(instances) > 1:
                 logger.warning(
-                    f'MS instance passed as an argument ({args.instance}) is unrecognized!')
+                    f'MS instance passed as an argument ({args.instance}) is the hostname of {len(instances)} instances: {", ".join(instances)}')
+                host_instances = instances
                 args.instance = None
+            else:
+                try:
+                    remote_user, remote_host_fqdn, remote_pwd, clientID = client_accounts[instances[0]]
+                except KeyError:
+                    logger.warning(
+                        f'MS instance passed as an argument ({args.instance}) is unrecognized!')
+                    args.instance = None
+
+        if host_instances:
+            logger.info('User prompted to select one of the MS instances on that host...')
+            MS_client_menu = dict(enumerate(host_instances, start=1))
+            (remote_user, remote_host_fqdn, remote_pwd, clientID), temp_val = ask_user(logger,
+                                prompt=choice_prompt, header='Managed Services Instance', main_dict=client_accounts, menu_dict=MS_client_menu, column=7)
 
-        if not args.instance:
+        elif not args.instance:
             # if user invoked --ms but without --instance argument passed,
             # or if user provided an unrecognized --instance, then ask user for it
-            
-            logger.info('User prompted to select a MS client ID from the list...')
+            clientID = None
+            if args.client:
+                if args.client.upper() in client_index['instances']:
+                    clientID = args.client.upper()
+                else:
+                    logger.warning(
+                        f'MS client ID passed as an argument ({args.client}) is unrecognized!')
+
+            if not clientID:
+                logger.info('User prompted to select a MS client ID from the list...')
 
-            # extract all the unique MS Client IDs from the dictionary and display for user menu
-            # e.g. ALDIS, JCTRL, etc.
-            temp_list = list(set([ value[3] for key, value in client_accounts.items() ]))
-            temp_list.sort()
-            MS_clientID_menu = {}
-            counter = 1
-            for id in temp_list:
-                MS_clientID_menu[counter] = id
-                counter += 1
+                # all the unique MS Client IDs (sorted in the index) for user menu
+                # e.g. ALDIS, JCTRL, etc.
+                MS_clientID_menu = dict(enumerate(client_index['client_ids'], start=1))
 
-            temp_val, clientID = ask_user(logger, prompt=choice_prompt, header='MS Client ID', main_dict=client_accounts, menu_dict=MS_clientID_menu)
+                temp_val, clientID = ask_user(logger, prompt=choice_prompt, header='MS Client ID', main_dict=client_accounts, menu_dict=MS_clientID_menu)
 
-            # extract only the instances for the chosen MS client ID and display for user menu
+            # only the instances for the chosen MS client ID (from the index) for user menu
             # e.g. baldis1, baldis2, paldis1, paldis2
-            MS_client_menu = {}
-            counter = 1
-            for key,value in client_accounts.items():
-                if value[3] == clientID:
-                    MS_client_menu[counter] = key
-                    counter += 1
-            
+            MS_client_menu = dict(enumerate(client_index['instances'][clientID], start=1))
+
             # extract the remote_user, remote_host_fqdn, remote_pwd and clientID from client_accounts dictionary
             (remote_user, remote_host_fqdn, remote_pwd, clientID), temp_val = ask_user(logger,
                                 prompt=choice_prompt, header='Managed Services Instance', main_dict=client_accounts, menu_dict=MS_client_menu, column=7)
@@ -956,6 +4844,9 @@ def main():
 
     # prior to establishing FTP connection, check first if files exist locally;
     # exit if one or more files is missing
+    if action == 'upload' and args.segments > 1:
+        logger.warning('Segmented transfer (--segments) is only for downloads, uploading over a single session')
+
     if action == 'upload':
         logger.info('Validating if upload file(s) exists...')
         check_if_existing(logger, files)
@@ -963,9 +4854,37 @@ def main():
 
     logger.info(equal_sign_line)
 
-    # create a FtpConnection object
-    FTP = FtpConnection(unix_gate, gateway_location, gate_username, gate_passcode,
-                        server_group, args.instance, action, files, remote_host_fqdn, remote_user, remote_pwd, remote_dir, logger)
+    if not args.no_daemon and args.engine == 'ftplib':
+        # if a daemon holds authenticated sessions to this Unix gate, let it do the transfer
+        job = {'server_grp': server_group, 'ms_instance': args.instance, 'action': action, 'files': files,
+               'remote_host': remote_host_fqdn, 'remote_user': remote_user, 'remote_pwd': remote_pwd,
+               'remote_dir': remote_dir, 'local_dir': str(Path().absolute()), 'parallel': args.parallel,
+               'blocksize': blocksize, 'resume': args.resume, 'segments': args.segments,
+               'compress': args.compress, 'compress_post_command': compress_post_command, 'sync': args.sync,
+               'verify': args.verify, 'retries': retries, 'retry_backoff': retry_backoff,
+               'rate_limit': rate_limit, 'bundle_post_command': bundle_post_command}
+        submitted = submit_to_daemon(logger, unix_gate, job)
+
+        if submitted is False:
+            # the daemon already logged why the job failed and that the script is terminating
+            sys.exit()
+        elif submitted:
+            logger.info('End of program')
+            logger.info(f'Logged everything in {LOG_FILE}')
+            logger.info('Thank you for using the script!')
+            logger.info(f'END - {t()}')
+            logger.info(equal_sign_line)
+            return
+
+    # create a FtpConnection (or AsyncFtpConnection) object
+    engine = AsyncFtpConnection if args.engine == 'async' else FtpConnection
+    FTP = engine(unix_gate, gateway_location, gate_username, gate_passcode,
+                        server_group, args.instance, action, files, remote_host_fqdn, remote_user, remote_pwd, remote_dir, logger,
+                        parallel=args.parallel, show_progress=not args.no_progress and sys.stdout.isatty(),
+                        blocksize=blocksize, socket_buffer=socket_buffer, resume=args.resume,
+                        segments=args.segments, compress=args.compress, compress_post_command=compress_post_command,
+                        sync=args.sync, verify=args.verify, retries=retries, retry_backoff=retry_backoff,
+                        rate_limit=rate_limit, bundle_post_command=bundle_post_command)
 
     # establish connection with Unix gate, connect with chosen remote host
     # and proceed to transfer files